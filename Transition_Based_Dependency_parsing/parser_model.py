@@ -20,13 +20,64 @@ class ParserModel(nn.Module): # модель для предсказания п
 
         self.hidden_to_logits_weight = nn.Parameter(nn.init.xavier_uniform_(torch.empty(self.hidden_size, self.n_classes)))
         self.hidden_to_logits_bias = nn.Parameter(nn.init.uniform_(torch.empty(self.n_classes)))
+        self.precomputed = None # кэш вкладов частых токенов в скрытый слой, см. precompute
+        self.slots = None
+
+    def precompute(self, token_ids, max_bytes=None):
+        """
+        Режим вывода из Chen & Manning: вклад токена в позиции признака в скрытый слой, E[id] @ W[позиция],
+        не зависит от остальных признаков, поэтому для частых токенов он считается заранее, и скрытый слой
+        собирается суммой строк кэша. Для редких токенов остаётся умножение по их позициям.
+        Вызывается после load_state_dict; переход в режим обучения (train()) сбрасывает кэш.
+        token_ids - Для каждой из n_features позиций номера токенов для кэша, от самых частых
+        max_bytes - Ограничение памяти кэша: строки берутся по рангу частоты, сначала первые во всех позициях
+        """
+        ranked = [(rank, position, int(token)) for position, ids in enumerate(token_ids)
+                  for rank, token in enumerate(ids)]
+        ranked.sort(key=lambda item: item[0])
+        if max_bytes is not None:
+            ranked = ranked[:max(0, max_bytes // (self.hidden_size * 4))]
+        positions = torch.tensor([position for _, position, _ in ranked], dtype=torch.long)
+        tokens = torch.tensor([token for _, _, token in ranked], dtype=torch.long)
+        with torch.no_grad():
+            weight = self.embed_to_hidden_weight.view(self.n_features, self.embed_size, self.hidden_size)
+            # последняя строка нулевая: в неё попадают некэшированные пары
+            self.precomputed = torch.zeros(len(ranked) + 1, self.hidden_size, dtype=weight.dtype)
+            # по одной позиции за раз: кроме самого кэша, память нужна только под эмбеддинги строк позиции
+            for position in range(self.n_features):
+                rows = torch.nonzero(positions == position).view(-1)
+                if len(rows):
+                    self.precomputed[rows] = torch.matmul(self.embeddings[tokens[rows]], weight[position])
+        self.slots = torch.full((self.n_features, self.embeddings.shape[0]), len(ranked), dtype=torch.long)
+        self.slots[positions, tokens] = torch.arange(len(ranked))
+
+    def train(self, mode=True):
+        if mode:
+            self.precomputed = None # веса изменятся - кэш устареет
+            self.slots = None
+        return super(ParserModel, self).train(mode)
 
     def embedding_lookup(self, w):
         x = torch.index_select(self.embeddings, 0, w.view(-1)).view(w.shape[0], -1)
         return x
 
 
+    def hidden_precomputed(self, w):
+        # Скрытый слой до ReLU по кэшу precompute: сумма строк кэша плюс умножение для некэшированных токенов
+        slots = self.slots[torch.arange(self.n_features), w]
+        hidden = F.embedding_bag(slots, self.precomputed, mode='sum') + self.embed_to_hidden_bias
+        weight = self.embed_to_hidden_weight.view(self.n_features, self.embed_size, self.hidden_size)
+        missed = slots == len(self.precomputed) - 1
+        for position in torch.nonzero(missed.any(0)).view(-1).tolist():
+            rows = torch.nonzero(missed[:, position]).view(-1)
+            hidden.index_add_(0, rows, torch.matmul(self.embeddings[w[rows, position]], weight[position]))
+        return hidden
+
     def forward(self, w):
+        if self.precomputed is not None and not self.training:
+            with torch.no_grad():
+                logits = torch.matmul(F.relu(self.hidden_precomputed(w)), self.hidden_to_logits_weight) + self.hidden_to_logits_bias
+            return logits
         embed_output = self.embedding_lookup(w)
         first_layer_out = self.dropout(F.relu(torch.matmul(embed_output, self.embed_to_hidden_weight) + self.embed_to_hidden_bias))
         logits = torch.matmul(first_layer_out, self.hidden_to_logits_weight) + self.hidden_to_logits_bias
@@ -1,9 +1,19 @@
+import numpy as np
+
 class PartialParse(object): # реализация парсера на основе переходов
-    def __init__(self, sentence):
+    def __init__(self, sentence, root="ROOT", index=None):
         self.sentence = sentence
-        self.stack = ["ROOT"]
+        self.index = index # номер предложения во входе minibatch_parse
+        self.stack = [root]
         self.buffer = [i for i in sentence]
         self.dependencies = []
+        # потомки токенов для признаков: токен -> самый левый, второй слева, самый правый, второй справа.
+        # В arc-standard новый левый потомок (LA) всегда левее прежних, а новый правый (RA) - правее,
+        # поэтому индексы обновляются за O(1) без просмотра dependencies
+        self.leftmost = {}
+        self.leftmost2 = {}
+        self.rightmost = {}
+        self.rightmost2 = {}
 
 
     def parse_step(self, transition): # шаг алгоритма 
@@ -14,12 +24,20 @@ class PartialParse(object): # реализация парсера на осно
                 print("Невозможно перенести слово из буфера в стек!")
         elif transition == "LA": #Left Arc
             try:
-                self.dependencies.append((self.stack[-1], self.stack.pop(-2)))
+                head, dependent = self.stack[-1], self.stack.pop(-2)
+                self.dependencies.append((head, dependent))
+                if head in self.leftmost:
+                    self.leftmost2[head] = self.leftmost[head]
+                self.leftmost[head] = dependent
             except:
                 print("Невозможно установить левую зависимость!")
         elif transition == "RA": #Right Arc
             try:
-                self.dependencies.append((self.stack[-2], self.stack.pop(-1)))
+                head, dependent = self.stack[-2], self.stack.pop(-1)
+                self.dependencies.append((head, dependent))
+                if head in self.rightmost:
+                    self.rightmost2[head] = self.rightmost[head]
+                self.rightmost[head] = dependent
             except Exception as e:
                 print("Stack size: ", len(self.stack))
                 print("Невозможно установить правую зависимость!", e)
@@ -31,17 +49,127 @@ class PartialParse(object): # реализация парсера на осно
             self.parse_step(transition)
         return self.dependencies
 
+LA, RA, S = 0, 1, 2 # коды переходов BatchParse (как номера переходов в Parser: L, R, S)
+
+
+class BatchParse(object): # состояния разбора целого пакета предложений в массивах NumPy
+    def __init__(self, sentences, root=0):
+        # Слово предложения r задаётся позицией 1..n (0 - корень); массивы всех предложений лежат подряд,
+        # предложение r занимает [base[r], base[r] + n[r] + 1), так что память растёт с числом слов, а не
+        # с числом предложений на длину самого длинного
+        self.sentences = sentences
+        self.root = root
+        self.n = np.array([len(sentence) for sentence in sentences], dtype=np.int64)
+        self.base = np.zeros(len(sentences), dtype=np.int64)
+        np.cumsum(self.n[:-1] + 1, out=self.base[1:])
+        total = int(self.n.sum()) + len(sentences)
+        self.stack = np.zeros(total, dtype=np.int32) # стек: позиции слов, дно - корень
+        self.stack_size = np.ones(len(sentences), dtype=np.int32)
+        self.next = np.ones(len(sentences), dtype=np.int32) # позиция первого слова буфера (n + 1 - буфер пуст)
+        self.head = np.full(total, -1, dtype=np.int32)
+        # потомки позиции, как в PartialParse: самый левый, второй слева, самый правый, второй справа (-1 - нет)
+        self.leftmost = np.full(total, -1, dtype=np.int32)
+        self.leftmost2 = np.full(total, -1, dtype=np.int32)
+        self.rightmost = np.full(total, -1, dtype=np.int32)
+        self.rightmost2 = np.full(total, -1, dtype=np.int32)
+        self.arcs = np.zeros(total, dtype=np.int32) # зависимые в порядке появления дуг
+        self.arc_count = np.zeros(len(sentences), dtype=np.int32)
+
+    def __len__(self):
+        return len(self.sentences)
+
+    def buffer_size(self, rows):
+        return self.n[rows] + 1 - self.next[rows]
+
+    def finished(self, rows=slice(None)):
+        return (self.stack_size[rows] == 1) & (self.next[rows] > self.n[rows])
+
+    def apply(self, rows, transitions): # один шаг для предложений rows (без повторов): переходы LA, RA, S
+        rows = np.asarray(rows, dtype=np.int64)
+        transitions = np.asarray(transitions)
+        size = self.stack_size[rows]
+        illegal = np.where(transitions == S, self.next[rows] > self.n[rows], size < 2)
+        if illegal.any():
+            row = rows[illegal.argmax()]
+            raise ValueError(f"Недопустимый переход {transitions[illegal.argmax()]} для предложения {row}: "
+                             f"в стеке {self.stack_size[row]}, в буфере {self.buffer_size(row)}")
+        base = self.base[rows]
+        top = base + size - 1 # индекс вершины стека
+
+        shift = transitions == S
+        r = rows[shift]
+        self.stack[top[shift] + 1] = self.next[r]
+        self.next[r] += 1
+        self.stack_size[r] += 1
+
+        left = transitions == LA
+        b, t = base[left], top[left]
+        head, dependent = self.stack[t], self.stack[t - 1]
+        self._add_arcs(rows[left], b, head, dependent)
+        self.leftmost2[b + head] = self.leftmost[b + head] # новый левый потомок левее прежних
+        self.leftmost[b + head] = dependent
+        self.stack[t - 1] = head
+
+        right = transitions == RA
+        b, t = base[right], top[right]
+        head, dependent = self.stack[t - 1], self.stack[t]
+        self._add_arcs(rows[right], b, head, dependent)
+        self.rightmost2[b + head] = self.rightmost[b + head] # новый правый потомок правее прежних
+        self.rightmost[b + head] = dependent
+
+        self.stack_size[rows[~shift]] -= 1
+
+    def _add_arcs(self, rows, base, head, dependent):
+        self.head[base + dependent] = head
+        self.arcs[base + self.arc_count[rows]] = dependent
+        self.arc_count[rows] += 1
+
+    def dependencies(self, row): # дуги предложения в порядке появления, как PartialParse.dependencies
+        sentence = self.sentences[row]
+        base = self.base[row]
+        token = lambda i: self.root if i == 0 else sentence[i - 1]
+        return [(token(int(self.head[base + d])), token(int(d)))
+                for d in self.arcs[base:base + self.arc_count[row]]]
+
+
 def minibatch_parse(sentences, model, batch_size): # анализ предложений
-    dependencies = []
-    partial_parses = list(map(lambda x: PartialParse(x), sentences)) # список объектов типа PartialParse 
-    unfinished_parses = partial_parses[:] # копия partial_parses
-    while unfinished_parses:
-        transitions = model.predict(unfinished_parses[:batch_size])
-        
-        for parse, transition in zip(unfinished_parses[:batch_size], transitions):
+    # Непрерывная пакетная обработка: batch_size активных мест, освободившееся место сразу занимает
+    # следующее предложение из очереди (длинные первыми, чтобы в конце не ждать одно длинное),
+    # поэтому каждый вызов модели идёт на полную ширину пакета. Результат - в порядке входа.
+    # Модель с predict_batch(state, rows) разбирает всё в BatchParse и возвращает коды переходов,
+    # иначе - объекты PartialParse и predict(partial_parses) (номер предложения - parse.index)
+    if hasattr(model, "predict_batch"):
+        return _minibatch_parse_arrays(sentences, model, batch_size)
+    partial_parses = [PartialParse(sentence, index=i) for i, sentence in enumerate(sentences)]
+    queue = sorted(partial_parses, key=lambda parse: len(parse.sentence), reverse=True)
+    active = queue[:batch_size]
+    waiting = batch_size # следующий в очереди
+    while active:
+        transitions = model.predict(active)
+        for slot, (parse, transition) in enumerate(zip(active, transitions)):
             parse.parse_step(transition)
             if len(parse.stack) == 1 and len(parse.buffer) == 0:
-                unfinished_parses = [x for x in unfinished_parses if x!= parse]
-    dependencies = [i.dependencies for i in partial_parses]
+                active[slot] = None
+                if waiting < len(queue):
+                    active[slot] = queue[waiting]
+                    waiting += 1
+        if None in active:
+            active = [parse for parse in active if parse is not None]
+    return [parse.dependencies for parse in partial_parses]
 
-    return dependencies
\ No newline at end of file
+def _minibatch_parse_arrays(sentences, model, batch_size):
+    state = BatchParse(sentences)
+    queue = np.argsort(-state.n, kind="stable")
+    queue = queue[~state.finished(queue)]
+    active = queue[:batch_size].copy()
+    waiting = len(active)
+    while active.size:
+        state.apply(active, model.predict_batch(state, active))
+        slots = np.flatnonzero(state.finished(active))
+        if slots.size:
+            refill = queue[waiting:waiting + slots.size]
+            waiting += refill.size
+            active[slots[:refill.size]] = refill
+            if refill.size < slots.size: # очередь кончилась - пакет сужается
+                active = np.delete(active, slots[refill.size:])
+    return [state.dependencies(row) for row in range(len(state))]
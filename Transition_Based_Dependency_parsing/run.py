@@ -17,6 +17,8 @@ from utils.parser_utils import minibatches, load_and_preprocess_data, AverageMet
 
 parser = argparse.ArgumentParser(description='Train neural dependency parser in pytorch')
 parser.add_argument('-d', '--debug', action='store_true', help='whether to enter debug mode')
+parser.add_argument('--precompute', type=int, default=0, help='cache hidden-layer contributions of the N most frequent words (0 - off)')
+parser.add_argument('--precompute-mb', type=float, help='memory limit for the precomputed cache in MiB')
 args = parser.parse_args()
 
 def train(parser, train_data, dev_data, output_path, batch_size=1024, n_epochs=10, lr=0.0005):
@@ -93,6 +95,10 @@ if __name__ == "__main__":
     
     relative_path = os.path.join("results", "20250317_214836", "model.weights")
     model.load_state_dict(torch.load(relative_path, weights_only=True))
+    model.eval()
+    if args.precompute:
+        max_bytes = int(args.precompute_mb * 2 ** 20) if args.precompute_mb else None
+        model.precompute(parser.frequent_feature_ids(args.precompute), max_bytes=max_bytes)
 
     parser.model = model
     while True:
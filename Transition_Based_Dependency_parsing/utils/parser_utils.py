@@ -3,7 +3,7 @@ import os
 import logging
 from collections import Counter
 from . general_utils import get_minibatches
-from parser_transitions import minibatch_parse
+from parser_transitions import PartialParse, minibatch_parse
 import spacy
 
 from tqdm import tqdm
@@ -121,55 +121,89 @@ class Parser(object):
         
         return {'word': word, 'pos' : pos} 
     
-    def extract_features(self, stack, buf, arcs, ex):
+    def extract_features(self, parse, ex):
+        # parse - PartialParse: стек, буфер и индексы потомков (leftmost, rightmost, ...),
+        # которые обновляются при каждом переходе, поэтому признаки берутся без просмотра всех дуг
+        stack, buf = parse.stack, parse.buffer
         if stack[0] == "ROOT":
             stack[0] = 0
-
-        def get_lc(k):
-            return sorted([arc[1] for arc in arcs if arc[0] == k and arc[1] < k])
-
-        def get_rc(k):
-            return sorted([arc[1] for arc in arcs if arc[0] == k and arc[1] > k],
-                          reverse=True)
-
+        leftmost, leftmost2 = parse.leftmost, parse.leftmost2
+        rightmost, rightmost2 = parse.rightmost, parse.rightmost2
+
+        def children(k):
+            # lc, rc, второй слева, второй справа, самый левый у lc, самый правый у rc
+            lc = leftmost.get(k)
+            rc = rightmost.get(k)
+            return (lc, rc, leftmost2.get(k), rightmost2.get(k),
+                    leftmost.get(lc) if lc is not None else None,
+                    rightmost.get(rc) if rc is not None else None)
+
+        return self._features(stack[-3:], buf[:3], children, ex)
+
+    def extract_batch_features(self, state, rows, tokens, out):
+        """
+        Признаки сразу для предложений rows пакета BatchParse (parser_transitions) - те же, что extract_features:
+        позиции слов (верх стека, начало буфера, потомки из индексов leftmost, rightmost, ...) вычисляются
+        выборками из массивов состояния, затем по ним выбираются номера слов, частей речи и меток.
+        tokens - (word, pos, label): номера токенов всех предложений пакета в раскладке state (base[r] + позиция)
+        out - Массив (не меньше len(rows), n_features) для результата, переиспользуется между шагами
+        """
+        word, pos, label = tokens
+        base = state.base[rows]
+        size = state.stack_size[rows]
+        first = state.next[rows].astype(np.int64)
+        last = state.n[rows]
+        stack = state.stack
+
+        # positions[:, j] - позиция слова j-го признака в предложении (-1 - нет слова)
+        positions = np.empty((len(rows), 18), dtype=np.int64)
+        for depth in range(3): # stack[-3:]: третий сверху, второй, вершина
+            below = 2 - depth
+            positions[:, depth] = np.where(size > below, stack[base + np.maximum(size - 1 - below, 0)], -1)
+        for offset in range(3): # buf[:3]
+            positions[:, 3 + offset] = np.where(first + offset <= last, first + offset, -1)
+        children = (state.leftmost, state.rightmost, state.leftmost2, state.rightmost2)
+        for i in range(2): # вершина стека и второй сверху
+            k = positions[:, 2 - i]
+            column = 6 + 6 * i
+            for c, index in enumerate(children):
+                positions[:, column + c] = np.where(k >= 0, index[base + np.maximum(k, 0)], -1)
+            for c, index in ((4, state.leftmost), (5, state.rightmost)): # самый левый у lc, самый правый у rc
+                child = positions[:, column + c - 4]
+                positions[:, column + c] = np.where(child >= 0, index[base + np.maximum(child, 0)], -1)
+
+        found = positions >= 0
+        flat = base[:, None] + np.maximum(positions, 0)
+        out = out[:len(rows)]
+        out[:, :18] = np.where(found, word[flat], self.NULL)
+        column = 18
+        if self.use_pos:
+            out[:, column:column + 18] = np.where(found, pos[flat], self.P_NULL)
+            column += 18
+        if self.use_dep:
+            out[:, column:column + 12] = np.where(found[:, 6:], label[flat[:, 6:]], self.L_NULL)
+        return out
+
+    def _features(self, stack, buf, children, ex):
+        # stack - до трёх верхних элементов стека, buf - до трёх первых слов буфера,
+        # children(k) - шесть потомков k для признаков (None - нет потомка)
+        word, pos, label = ex['word'], ex['pos'], ex['label']
         p_features = []
         l_features = []
-        features = [self.NULL] * (3 - len(stack)) + [ex['word'][x] for x in stack[-3:]]
-        features += [ex['word'][x] for x in buf[:3]] + [self.NULL] * (3 - len(buf))
+        features = [self.NULL] * (3 - len(stack)) + [word[x] for x in stack[-3:]]
+        features += [word[x] for x in buf[:3]] + [self.NULL] * (3 - len(buf))
         if self.use_pos:
-            p_features = [self.P_NULL] * (3 - len(stack)) + [ex['pos'][x] for x in stack[-3:]]
-            p_features += [ex['pos'][x] for x in buf[:3]] + [self.P_NULL] * (3 - len(buf))
+            p_features = [self.P_NULL] * (3 - len(stack)) + [pos[x] for x in stack[-3:]]
+            p_features += [pos[x] for x in buf[:3]] + [self.P_NULL] * (3 - len(buf))
 
         for i in range(2):
             if i < len(stack):
-                k = stack[-i-1]
-                lc = get_lc(k)
-                rc = get_rc(k)
-                llc = get_lc(lc[0]) if len(lc) > 0 else []
-                rrc = get_rc(rc[0]) if len(rc) > 0 else []
-
-                features.append(ex['word'][lc[0]] if len(lc) > 0 else self.NULL)
-                features.append(ex['word'][rc[0]] if len(rc) > 0 else self.NULL)
-                features.append(ex['word'][lc[1]] if len(lc) > 1 else self.NULL)
-                features.append(ex['word'][rc[1]] if len(rc) > 1 else self.NULL)
-                features.append(ex['word'][llc[0]] if len(llc) > 0 else self.NULL)
-                features.append(ex['word'][rrc[0]] if len(rrc) > 0 else self.NULL)
-
+                found = children(stack[-i-1])
+                features += [self.NULL if c is None else word[c] for c in found]
                 if self.use_pos:
-                    p_features.append(ex['pos'][lc[0]] if len(lc) > 0 else self.P_NULL)
-                    p_features.append(ex['pos'][rc[0]] if len(rc) > 0 else self.P_NULL)
-                    p_features.append(ex['pos'][lc[1]] if len(lc) > 1 else self.P_NULL)
-                    p_features.append(ex['pos'][rc[1]] if len(rc) > 1 else self.P_NULL)
-                    p_features.append(ex['pos'][llc[0]] if len(llc) > 0 else self.P_NULL)
-                    p_features.append(ex['pos'][rrc[0]] if len(rrc) > 0 else self.P_NULL)
-
+                    p_features += [self.P_NULL if c is None else pos[c] for c in found]
                 if self.use_dep:
-                    l_features.append(ex['label'][lc[0]] if len(lc) > 0 else self.L_NULL)
-                    l_features.append(ex['label'][rc[0]] if len(rc) > 0 else self.L_NULL)
-                    l_features.append(ex['label'][lc[1]] if len(lc) > 1 else self.L_NULL)
-                    l_features.append(ex['label'][rc[1]] if len(rc) > 1 else self.L_NULL)
-                    l_features.append(ex['label'][llc[0]] if len(llc) > 0 else self.L_NULL)
-                    l_features.append(ex['label'][rrc[0]] if len(rrc) > 0 else self.L_NULL)
+                    l_features += [self.L_NULL if c is None else label[c] for c in found]
             else:
                 features += [self.NULL] * 6
                 if self.use_pos:
@@ -181,6 +215,14 @@ class Parser(object):
         assert len(features) == self.n_features
         return features
 
+    def frequent_feature_ids(self, n_words=10000):
+        # Номера токенов для ParserModel.precompute по позициям признаков, от самых частых (tok2id строится
+        # по убыванию частоты): n_words частых слов со служебными NULL, ROOT, UNK, все части речи и метки
+        words = [self.NULL, self.ROOT, self.UNK] + list(range(self.P_ROOT + 1, min(self.UNK, self.P_ROOT + 1 + n_words)))
+        tags = [self.P_NULL, self.P_ROOT, self.P_UNK] + list(range(self.L_NULL + 1, self.P_UNK))
+        labels = [self.L_NULL] + list(range(self.L_NULL))
+        return [words] * 18 + ([tags] * 18 if self.use_pos else []) + ([labels] * 12 if self.use_dep else [])
+
     def get_oracle(self, stack, buf, ex):
         if len(stack) < 2:
             return self.n_trans - 1
@@ -215,27 +257,23 @@ class Parser(object):
         for id, ex in enumerate(examples):
             n_words = len(ex['word']) - 1
 
-            stack = [0]
-            buf = [i + 1 for i in range(n_words)]
-            arcs = []
+            parse = PartialParse([i + 1 for i in range(n_words)], root=0)
             instances = []
             for i in range(n_words * 2):
-                gold_t = self.get_oracle(stack, buf, ex)
+                gold_t = self.get_oracle(parse.stack, parse.buffer, ex)
                 if gold_t is None:
                     break
-                legal_labels = self.legal_labels(stack, buf)
+                legal_labels = self.legal_labels(parse.stack, parse.buffer)
                 assert legal_labels[gold_t] == 1
-                instances.append((self.extract_features(stack, buf, arcs, ex),
+                instances.append((self.extract_features(parse, ex),
                                   legal_labels, gold_t))
+                # метка дуги в признаки не входит (use_dep берёт метки из ex), поэтому хватает самого перехода
                 if gold_t == self.n_trans - 1:
-                    stack.append(buf[0])
-                    buf = buf[1:]
+                    parse.parse_step("S")
                 elif gold_t < self.n_deprel:
-                    arcs.append((stack[-1], stack[-2], gold_t))
-                    stack = stack[:-2] + [stack[-1]]
+                    parse.parse_step("LA")
                 else:
-                    arcs.append((stack[-2], stack[-1], gold_t - self.n_deprel))
-                    stack = stack[:-1]
+                    parse.parse_step("RA")
             else:
                 succ += 1
                 all_instances += instances
@@ -248,15 +286,8 @@ class Parser(object):
         return labels
 
     def parse(self, dataset, eval_batch_size=5000):
-        sentences = []
-        sentence_id_to_idx = {}
-        for i, example in enumerate(dataset):
-            n_words = len(example['word']) - 1
-            sentence = [j + 1 for j in range(n_words)]
-            sentences.append(sentence)
-            sentence_id_to_idx[id(sentence)] = i
-
-        model = ModelWrapper(self, dataset, sentence_id_to_idx)
+        sentences = [[j + 1 for j in range(len(example['word']) - 1)] for example in dataset]
+        model = ModelWrapper(self, dataset)
         dependencies = minibatch_parse(sentences, model, eval_batch_size)
 
         UAS = all_tokens = 0.0
@@ -277,14 +308,9 @@ class Parser(object):
         return UAS, dependencies
     
     def predict(self, example):
-        sentences = []
-        sentence_id_to_idx = {}
-
         n_words = len(example['word']) - 1 
-        sentence = [j + 1 for j in range(n_words)]
-        sentences.append(sentence)
-        sentence_id_to_idx[id(sentence)] = 0
-        model = ModelWrapper(self, [example], sentence_id_to_idx)
+        sentences = [[j + 1 for j in range(n_words)]]
+        model = ModelWrapper(self, [example])
 
         dependencies = minibatch_parse(sentences, model, 1)
 
@@ -292,15 +318,17 @@ class Parser(object):
 
 
 class ModelWrapper(object):
-    def __init__(self, parser, dataset, sentence_id_to_idx):
+    def __init__(self, parser, dataset):
+        # dataset[i] - пример i-го предложения, переданного в minibatch_parse
         self.parser = parser
         self.dataset = dataset
-        self.sentence_id_to_idx = sentence_id_to_idx
+        self._state = None # пакет BatchParse, для которого собраны _tokens
+        self._tokens = None
+        self._features = np.empty((0, parser.n_features), dtype=np.int64) # буферы predict_batch
+        self._legal = np.empty((0, 3), dtype=np.float32) # LA, RA, S
 
     def predict(self, partial_parses):
-        mb_x = [self.parser.extract_features(p.stack, p.buffer, p.dependencies,
-                                             self.dataset[self.sentence_id_to_idx[id(p.sentence)]])
-                for p in partial_parses]
+        mb_x = [self.parser.extract_features(p, self.dataset[p.index]) for p in partial_parses]
         mb_x = np.array(mb_x).astype('int32')
         mb_x = torch.from_numpy(mb_x).long()
         mb_l = [self.parser.legal_labels(p.stack, p.buffer) for p in partial_parses]
@@ -311,6 +339,29 @@ class ModelWrapper(object):
         pred = ["S" if p == 2 else ("LA" if p == 0 else "RA") for p in pred]
         return pred
 
+    def predict_batch(self, state, rows):
+        # Переходы для предложений rows пакета BatchParse: коды 0 - LA, 1 - RA, 2 - S
+        if self._state is not state:
+            # номера токенов всех предложений подряд, в раскладке массивов state (word[0] - ROOT)
+            self._state = state
+            self._tokens = tuple(np.concatenate([np.asarray(self.dataset[row][key], dtype=np.int64)
+                                                 for row in range(len(state))] or [np.empty(0, dtype=np.int64)])
+                                 for key in ('word', 'pos', 'label'))
+        if len(self._features) < len(rows):
+            self._features = np.empty((len(rows), self.parser.n_features), dtype=np.int64)
+            self._legal = np.empty((len(rows), 3), dtype=np.float32)
+        mb_x = self.parser.extract_batch_features(state, rows, self._tokens, self._features)
+        size = state.stack_size[rows]
+        # как legal_labels: LA при стеке больше 2, RA - не меньше 2, S - при непустом буфере
+        mb_l = self._legal[:len(rows)]
+        mb_l[:, 0] = size > 2
+        mb_l[:, 1] = size >= 2
+        mb_l[:, 2] = state.buffer_size(rows) > 0
+
+        pred = self.parser.model(torch.from_numpy(mb_x))
+        pred = pred.detach().numpy()
+        return np.argmax(pred + 10000 * mb_l, 1)
+
 def read_conll(in_file, lowercase=False, max_example=None):
     examples = []
     with open(in_file) as f:
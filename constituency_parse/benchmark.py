@@ -0,0 +1,376 @@
+"""
+Замеры производительности для разбора составляющих.
+
+Запуск из каталога constituency_parse:
+    python benchmark.py cnf --grammar eng_parse/cf_grammar.txt --output cnf_bench.json
+    python benchmark.py reduce --grammar eng_parse/cf_grammar.txt
+    python benchmark.py parse --lang rus --parsers cky cky-numpy earley --output rus_bench.json
+    python benchmark.py parse --lang eng --lengths 5 10 20 --baseline rus_bench_old.json
+
+Предложения для parse порождаются случайно из исходной грамматики языка (нужной длины) или берутся
+из файла (--sentences). Отдельно замеряются загрузка грамматики, to_cnf, компиляция, parse и
+extract_parse_tree; пиковая память разбора - через tracemalloc. Разбор английских предложений
+длиннее 20-30 слов движком sets занимает минуты, поэтому для eng по умолчанию длины меньше.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, 'eng_parse'))  # код грамматики одинаков для eng_parse и rus_parse
+
+import cfg
+import cky_parser
+import earley_parser
+
+
+def sample_grammar(grammar, fraction):
+    # Подграмматика: первые fraction правил каждого нетерминала (хотя бы одно)
+    sample = cfg.CFGrammar()
+    for left, rights in grammar.rules.items():
+        for right in rights[:max(1, math.ceil(len(rights) * fraction))]:
+            sample.add_rule(left, right, grammar.weights.get((left, right)))
+    return sample
+
+
+def scale_grammar(grammar, copies):
+    """
+    Увеличенная грамматика: copies копий всех нетерминалов (NP -> NP~1, NP~2, ...) с общими
+    терминалами; стартовый символ выводит стартовые символы копий единичными правилами.
+    Моделирует рост грамматики при индукции по всему трибанку.
+    """
+    start = next(iter(grammar.rules))
+    scaled = cfg.CFGrammar()
+    for copy in range(copies):
+        scaled.add_rule(start, (f"{start}~{copy}",))
+        for left, rights in grammar.rules.items():
+            for right in rights:
+                renamed = tuple(symbol if grammar.is_terminal(symbol) else f"{symbol}~{copy}" for symbol in right)
+                scaled.add_rule(f"{left}~{copy}", renamed, grammar.weights.get((left, right)))
+    return scaled
+
+
+def bench_cnf(args):
+    # Время CFGrammar.to_cnf в зависимости от размера грамматики
+    grammar = cfg.CFGrammar(args.grammar)
+    variants = [(f"fraction={fraction:g}", sample_grammar(grammar, fraction)) for fraction in args.fractions]
+    variants += [(f"scale={copies}", scale_grammar(grammar, copies)) for copies in args.scales]
+
+    results = []
+    for name, variant in variants:
+        symbols, rules = variant.size()
+        start = time.perf_counter()
+        cnf = variant.to_cnf()
+        seconds = time.perf_counter() - start
+        cnf_symbols, cnf_rules = cnf.size()
+        results.append({'variant': name, 'symbols': symbols, 'rules': rules, 'cnf_symbols': cnf_symbols,
+                        'cnf_rules': cnf_rules, 'seconds': round(seconds, 4)})
+        print(f"{name:>14}: {rules:>8} rules -> {cnf_rules:>9} CNF rules in {seconds:.3f} s")
+    return results
+
+
+def compiled_size(grammar):
+    # Размер файла скомпилированной грамматики в байтах
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'grammar.cfgc')
+        grammar.compile().save(path)
+        return os.path.getsize(path)
+
+
+# Контрольные предложения для reduce: пунктуация трибанка - правила-слова вида , -> ,
+REDUCE_SENTENCES = ["That cold , empty sky was full of fire and light", "That sky was full of fire and light ."]
+
+
+def bench_reduce(args):
+    # Размер грамматики, её CNF и компилированного файла до и после CFGrammar.reduce;
+    # контрольные предложения (с пунктуацией) должны распознаваться всеми вариантами - язык не меняется
+    grammar = cfg.CFGrammar(args.grammar)
+    sentences = [sentence.split() for sentence in args.sentences]
+    variants = [("original", lambda: grammar), ("reduced", lambda: grammar.reduce()),
+                ("collapsed", lambda: grammar.reduce(collapse_tags=True))]
+
+    results = []
+    for name, build in variants:
+        start = time.perf_counter()
+        variant = build()
+        seconds = time.perf_counter() - start
+        symbols, rules = variant.size()
+        cnf = variant.to_cnf()
+        cnf_symbols, cnf_rules = cnf.size()
+        compiled_bytes = compiled_size(cnf)
+        unary_parser = cky_parser.CKYParser(variant.to_cnf(keep_unary=True))
+        recognized = sum(unary_parser.recognize(sentence) for sentence in sentences)
+        results.append({'variant': name, 'symbols': symbols, 'rules': rules, 'cnf_symbols': cnf_symbols,
+                        'cnf_rules': cnf_rules, 'compiled_bytes': compiled_bytes, 'recognized': recognized,
+                        'seconds': round(seconds, 4)})
+        print(f"{name:>10}: {symbols:>5} symbols, {rules:>6} rules -> {cnf_rules:>8} CNF rules, "
+              f"{compiled_bytes / 2 ** 20:.1f} MiB compiled, {recognized}/{len(sentences)} sentences "
+              f"recognized ({seconds:.3f} s)")
+    return results
+
+
+LANGUAGES = {
+    'eng': {'grammar': os.path.join(BASE_DIR, 'eng_parse', 'cf_grammar.txt'), 'lengths': [5, 10, 15, 20]},
+    'rus': {'grammar': os.path.join(BASE_DIR, 'rus_parse', 'cfgrammar.txt'), 'lengths': [5, 10, 25, 50, 100]},
+}
+
+# Сравниваемые парсеры: параметры CFGrammar.to_cnf (None - парсер работает с исходной грамматикой)
+# и как построить парсер по грамматике
+PARSERS = {
+    'cky': ({}, lambda grammar: cky_parser.CKYParser(grammar)),
+    'cky-numpy': ({}, lambda grammar: cky_parser.CKYParser(grammar, engine="numpy")),
+    'cky-pcfg': ({}, lambda grammar: cky_parser.CKYParser(grammar, pcfg=True)),
+    'cky-coarse': ({}, lambda grammar: cky_parser.CKYParser(grammar, coarse_to_fine=True)),
+    'cky-pcfg-coarse': ({}, lambda grammar: cky_parser.CKYParser(grammar, pcfg=True, coarse_to_fine=True)),
+    'cky-pcfg-coarse5': ({}, lambda grammar: cky_parser.CKYParser(grammar, pcfg=True, coarse_to_fine=True,
+                                                                  coarse_threshold=5.0)),
+    'cky-wavefront': ({}, lambda grammar: cky_parser.CKYParser(grammar, wavefront_workers=os.cpu_count() or 1,
+                                                               wavefront_min_length=32)),
+    'cky-unary': ({'keep_unary': True}, lambda grammar: cky_parser.CKYParser(grammar)),
+    'cky-pcfg-unary': ({'keep_unary': True}, lambda grammar: cky_parser.CKYParser(grammar, pcfg=True)),
+    'earley': (None, lambda grammar: earley_parser.EarleyParser(grammar)),
+}
+
+
+def sequence_mask(masks, limit):
+    # Маска длин цепочки символов по маскам длин символов (бит l - есть вывод длины l)
+    result = 1
+    for mask in masks:
+        combined = 0
+        while mask:
+            low = mask & -mask
+            combined |= result << (low.bit_length() - 1)
+            mask ^= low
+        result = combined & limit
+        if not result:
+            break
+    return result
+
+
+def length_masks(grammar, max_length):
+    """
+    Возможные длины выводов каждого нетерминала, не больше max_length: битовая маска по символу.
+    Считается итерациями до неподвижной точки; пересчитываются только нетерминалы, у которых
+    изменилась маска одного из символов правых частей.
+    """
+    limit = (1 << (max_length + 1)) - 1
+    masks = dict.fromkeys(grammar.rules, 0)
+    users = {}  # символ -> нетерминалы, в правых частях которых он встречается
+    for left, rights in grammar.rules.items():
+        for right in rights:
+            for symbol in right:
+                users.setdefault(symbol, set()).add(left)
+
+    queue = list(grammar.rules)
+    queued = set(queue)
+    while queue:
+        left = queue.pop()
+        queued.discard(left)
+        mask = masks[left]
+        for right in grammar.rules[left]:
+            mask |= sequence_mask([masks.get(symbol, 2) for symbol in right], limit)
+        if mask != masks[left]:
+            masks[left] = mask
+            for user in users.get(left, ()):
+                if user not in queued:
+                    queued.add(user)
+                    queue.append(user)
+    return masks
+
+
+def generate_sentence(grammar, masks, length, rng):
+    """
+    Случайное предложение длины length из грамматики (None, если такой длины не бывает).
+    Правило и длины потомков выбираются только среди тех, для которых вывод нужной длины существует.
+    """
+    start = next(iter(grammar.rules))
+    if not masks[start] >> length & 1:
+        return None
+    limit = (1 << (length + 1)) - 1
+    words = []
+    stack = [(start, length)]
+    while stack:
+        symbol, size = stack.pop()
+        if grammar.is_terminal(symbol):
+            words.append(symbol)
+            continue
+        rights = [right for right in grammar.rules[symbol]
+                  if sequence_mask([masks.get(child, 2) for child in right], limit) >> size & 1]
+        right = rng.choice(rights)
+        symbol_masks = [masks.get(child, 2) for child in right]
+        # suffixes[k] - маска длин для right[k:]
+        suffixes = [1] * (len(right) + 1)
+        for k in range(len(right) - 1, -1, -1):
+            suffixes[k] = sequence_mask(symbol_masks[k:], limit)
+        sizes = []
+        remaining = size
+        for k, mask in enumerate(symbol_masks):
+            options = [l for l in range(1, remaining + 1) if mask >> l & 1 and suffixes[k + 1] >> (remaining - l) & 1]
+            sizes.append(rng.choice(options))
+            remaining -= sizes[-1]
+        stack.extend(reversed(list(zip(right, sizes))))
+    return words
+
+
+def load_sentences(args, grammar, masks, rng):
+    # Предложения из файла или по args.per_length случайных предложений каждой длины
+    if args.sentences:
+        with open(args.sentences, encoding='utf8') as file:
+            return [line.split() for line in file if line.strip()]
+    sentences = []
+    for length in args.lengths:
+        for _ in range(args.per_length):
+            sentence = generate_sentence(grammar, masks, length, rng)
+            if sentence is None:
+                print(f"no sentences of length {length} in the grammar", file=sys.stderr)
+                break
+            sentences.append(sentence)
+    return sentences
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def peak_memory(function, *args):
+    # Пиковый прирост памяти Python-объектов при вызове function (tracemalloc)
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_parser(name, grammar_path, sentences, measure_memory):
+    # Замеры одного парсера: подготовка грамматики и разбор предложений, сгруппированный по длине
+    cnf_options, build = PARSERS[name]
+    grammar, load_seconds = timed(cfg.CFGrammar, grammar_path)
+    cnf_seconds = compile_seconds = None
+    if cnf_options is not None:
+        grammar, cnf_seconds = timed(grammar.to_cnf, **cnf_options)
+        grammar, compile_seconds = timed(grammar.compile)
+    parser, build_seconds = timed(build, grammar)
+
+    by_length = {}
+    for sentence in sentences:
+        result, parse_seconds = timed(parser.parse, sentence)
+        _, extract_seconds = timed(parser.extract_parse_tree, sentence, *result[1:])
+        stats = by_length.setdefault(len(sentence), {'parsed': 0, 'parse': [], 'extract': [], 'peak': []})
+        stats['parsed'] += bool(result[0])
+        stats['parse'].append(parse_seconds)
+        stats['extract'].append(extract_seconds)
+        del result  # таблица не должна попасть в замер памяти следующего разбора
+        if measure_memory:
+            stats['peak'].append(peak_memory(parser.parse, sentence))
+
+    lengths = []
+    for length, stats in sorted(by_length.items()):
+        record = {'length': length, 'sentences': len(stats['parse']), 'parsed': stats['parsed'],
+                  'parse_seconds_mean': statistics.mean(stats['parse']),
+                  'parse_seconds_max': max(stats['parse']),
+                  'extract_seconds_mean': statistics.mean(stats['extract'])}
+        if stats['peak']:
+            record['peak_bytes'] = max(stats['peak'])
+        lengths.append(record)
+        print(f"{name:>16} n={length:<4} parsed {stats['parsed']}/{len(stats['parse'])}, "
+              f"parse {record['parse_seconds_mean'] * 1000:.2f} ms, "
+              f"extract {record['extract_seconds_mean'] * 1000:.2f} ms"
+              + (f", peak {record['peak_bytes'] / 2 ** 20:.1f} MiB" if stats['peak'] else ""))
+    return {'parser': name, 'grammar': os.path.relpath(grammar_path, BASE_DIR),
+            'load_seconds': load_seconds, 'cnf_seconds': cnf_seconds, 'compile_seconds': compile_seconds,
+            'build_seconds': build_seconds, 'lengths': lengths}
+
+
+def compare_with_baseline(results, baseline_path, tolerance):
+    # Сравнивает среднее время разбора с прошлым запуском; возвращает найденные замедления
+    with open(baseline_path, encoding='utf8') as file:
+        baseline = {(record['parser'], length['length']): length['parse_seconds_mean']
+                    for record in json.load(file)['results'] for length in record['lengths']}
+    regressions = []
+    for record in results:
+        for length in record['lengths']:
+            old = baseline.get((record['parser'], length['length']))
+            if old and length['parse_seconds_mean'] > old * (1 + tolerance):
+                regressions.append(f"{record['parser']} n={length['length']}: "
+                                   f"{old * 1000:.2f} ms -> {length['parse_seconds_mean'] * 1000:.2f} ms")
+    return regressions
+
+
+def bench_parse(args):
+    # Время и память разбора по длинам предложений для выбранных парсеров
+    language = LANGUAGES[args.lang]
+    grammar_path = args.grammar or language['grammar']
+    args.lengths = args.lengths or language['lengths']
+    rng = random.Random(args.seed)
+    grammar = cfg.CFGrammar(grammar_path)
+    sentences = load_sentences(args, grammar, length_masks(grammar, max(args.lengths)), rng)
+    if args.save_sentences:
+        with open(args.save_sentences, 'w', encoding='utf8') as file:
+            file.writelines(' '.join(sentence) + '\n' for sentence in sentences)
+
+    results = [bench_parser(name, grammar_path, sentences, not args.no_memory) for name in args.parsers]
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            args.exit_code = 1
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmarks for the constituency parsers')
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+
+    cnf_parser = commands.add_parser('cnf', help='time CFGrammar.to_cnf against grammar size')
+    cnf_parser.add_argument('--grammar', default=os.path.join(BASE_DIR, 'eng_parse', 'cf_grammar.txt'))
+    cnf_parser.add_argument('--fractions', type=float, nargs='+', default=[0.1, 0.25, 0.5, 1.0])
+    cnf_parser.add_argument('--scales', type=int, nargs='*', default=[2, 4])
+    cnf_parser.add_argument('--output', help='write results as JSON')
+    cnf_parser.set_defaults(run=bench_cnf)
+
+    reduce_parser = commands.add_parser('reduce', help='grammar size before and after CFGrammar.reduce')
+    reduce_parser.add_argument('--grammar', default=os.path.join(BASE_DIR, 'eng_parse', 'cf_grammar.txt'))
+    reduce_parser.add_argument('--sentences', nargs='+', default=REDUCE_SENTENCES,
+                               help='sentences every variant must recognize (tokens separated by spaces)')
+    reduce_parser.add_argument('--output', help='write results as JSON')
+    reduce_parser.set_defaults(run=bench_reduce)
+
+    parse_parser = commands.add_parser('parse', help='time parsing by sentence length for several parsers')
+    parse_parser.add_argument('--lang', choices=sorted(LANGUAGES), default='rus')
+    parse_parser.add_argument('--grammar', help='source grammar (default: the language grammar)')
+    parse_parser.add_argument('--parsers', nargs='+', choices=sorted(PARSERS), default=['cky', 'earley'])
+    parse_parser.add_argument('--lengths', type=int, nargs='+', help='sentence lengths to generate')
+    parse_parser.add_argument('--per-length', type=int, default=3, help='sentences per length')
+    parse_parser.add_argument('--sentences', help='parse sentences from this file instead of generating them')
+    parse_parser.add_argument('--save-sentences', help='write the generated sentences to this file')
+    parse_parser.add_argument('--seed', type=int, default=0)
+    parse_parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parse_parser.add_argument('--baseline', help='JSON from an earlier run to check for slowdowns')
+    parse_parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown against the baseline')
+    parse_parser.add_argument('--output', help='write results as JSON')
+    parse_parser.set_defaults(run=bench_parse)
+
+    args = arg_parser.parse_args()
+    args.exit_code = 0
+    results = args.run(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as file:
+            json.dump({'command': args.command, 'python': platform.python_version(), 'results': results},
+                      file, ensure_ascii=False, indent=2)
+    sys.exit(args.exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,23 @@
+import array
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+
+WEIGHT_PATTERN = re.compile(r'^\[([0-9.eE+-]+)\]$')  # частота правила в файле: NP -> DT NN [12]
+TAG_PATTERN = re.compile(r'^([^-=]+?)[-=]')  # функциональные метки и индексы трибанка: NP-SBJ-40, NP=3
+HELPER_PATTERN = re.compile(r'^([TX]_)\d+$')  # вспомогательные символы to_cnf: T_12, X_345
+
+
 class CFGrammar:
     def __init__(self, filename=None): 
         self.rules = {}  # Словарь для хранения правил грамматики
+        self.weights = {}  # (левая часть, правая часть) -> частота правила (для PCFG)
+        self._rule_sets = {}  # левая часть -> множество правых частей (проверка дубликатов за O(1))
         if filename:
             self.load_grammar(filename)  # Загружаем грамматику из файла (формат NON-TERM -> a | b | c | ... )
  
@@ -11,17 +28,44 @@ class CFGrammar:
                 line = line.strip() 
                 if line and not line.startswith('//'): 
                     left, right = line.split(' -> ') 
-                    right_parts = [tuple(prod.split()) for prod in right.split(' | ')] 
-                    if left not in self.rules: 
-                        self.rules[left] = [] 
-                    self.rules[left].extend(right_parts) 
+                    right_parts = [prod.split() for prod in right.split(' | ')] 
+                    for prod in right_parts:
+                        match = WEIGHT_PATTERN.match(prod[-1]) if len(prod) > 1 else None
+                        weight = None
+                        if match:
+                            prod = prod[:-1]
+                            weight = float(match.group(1))
+                        self.add_rule(left, tuple(prod), weight)
  
-    def add_rule(self, left, right): 
-        # Добавляет правило в грамматику
-        if left not in self.rules: 
-            self.rules[left] = [] 
-        if right not in self.rules[left]: 
+    def add_rule(self, left, right, weight=None): 
+        # Добавляет правило в грамматику (частота повторно добавленного правила суммируется)
+        rule_set = self._rule_sets.get(left)
+        if rule_set is None:
+            rule_set = self._rule_sets[left] = set(self.rules.setdefault(left, []))
+        if right not in rule_set: 
+            rule_set.add(right)
             self.rules[left].append(right) 
+        if weight is not None:
+            self.add_weight(left, right, weight)
+
+    def add_weight(self, left, right, weight):
+        # Увеличивает частоту правила left -> right
+        self.weights[(left, right)] = self.weights.get((left, right), 0.0) + weight
+
+    def rule_log_probs(self):
+        """
+        Логарифмы вероятностей правил, нормированные по левой части.
+        Без частот все правила одного нетерминала считаются равновероятными.
+        :return: Словарь (левая часть, правая часть) -> log P(правая часть | левая часть)
+        """
+        log_probs = {}
+        for left, rights in self.rules.items():
+            rights = list(dict.fromkeys(rights))
+            weights = [self.weights.get((left, right), 0.0 if self.weights else 1.0) for right in rights]
+            total = sum(weights)
+            for right, weight in zip(rights, weights):
+                log_probs[(left, right)] = math.log(weight / total) if weight > 0 else -math.inf
+        return log_probs
  
     def get_rules(self, left): 
         # Возвращает правила для указанного левого символа
@@ -30,20 +74,127 @@ class CFGrammar:
     def print(self): 
         # Выводит правила грамматики в консоль
         for left, right in self.rules.items(): 
-            right_side = ' | '.join([' '.join(prod) for prod in right]) 
+            right_side = ' | '.join([self.format_production(left, prod) for prod in right]) 
             print(f"{left} -> {right_side}")
 
+    def format_production(self, left, right):
+        # Правая часть правила в текстовом формате грамматики (с частотой, если она известна)
+        if (left, right) in self.weights:
+            return f"{' '.join(right)} [{self.weights[(left, right)]:g}]"
+        return ' '.join(right)
+
+    def size(self):
+        # Число нетерминалов и правил
+        return len(self.rules), sum(len(rights) for rights in self.rules.values())
+
+    def reduce(self, collapse_tags=False, verbose=False):
+        """
+        Сокращает грамматику: удаляет непорождающие нетерминалы (не выводят ни одной цепочки терминалов),
+        недостижимые из стартового символа и правила с ними, а также единичные правила вида A -> A.
+        Правило A -> A у части речи (все правила символа ведут к словам) - лексическое, слово совпадает
+        с меткой (пунктуация трибанка: , -> ,), и остаётся, как в to_cnf(keep_unary=True).
+        Совпавшие правила объединяются, их частоты складываются.
+        collapse_tags - Свести нетерминалы с функциональными метками и индексами трибанка к базовым
+                        категориям: NP-SBJ-40, NP-SBJ=3, NP-1 -> NP (см. collapse_symbol)
+        verbose - Вывести число нетерминалов и правил до и после сокращения
+        :return: Новая грамматика CFGrammar
+        """
+        # Части речи: все правые части - одно слово или сам символ (A -> A тогда тоже слово)
+        tags = {left for left, rights in self.rules.items()
+                if all(len(right) == 1 and (self.is_terminal(right[0]) or right[0] == left) for right in rights)}
+        merged = CFGrammar()
+        words = set()  # лексические правила A -> A сокращённой грамматики
+        for left, rights in self.rules.items():
+            new_left = collapse_symbol(left) if collapse_tags else left
+            for right in rights:
+                if right == (left,) and left in tags:
+                    words.add((new_left, right))
+                    merged.add_rule(new_left, right, self.weights.get((left, right)))
+                    continue
+                if collapse_tags:
+                    right_renamed = tuple(symbol if self.is_terminal(symbol) else collapse_symbol(symbol)
+                                          for symbol in right)
+                else:
+                    right_renamed = right
+                if right_renamed == (new_left,):
+                    continue
+                merged.add_rule(new_left, right_renamed, self.weights.get((left, right)))
+        if not merged.rules:
+            return merged
+
+        # Порождающие символы: правило становится полезным, когда все нетерминалы его правой части порождающие
+        rules = [(left, right) for left, rights in merged.rules.items() for right in rights]
+        missing = []  # число ещё не порождающих нетерминалов в правой части правила
+        waiting = {}  # нетерминал -> номера правил, где он встречается справа
+        queue = []
+        for index, (left, right) in enumerate(rules):
+            nonterminals = set() if (left, right) in words else {symbol for symbol in right
+                                                                 if not merged.is_terminal(symbol)}
+            missing.append(len(nonterminals))
+            for symbol in nonterminals:
+                waiting.setdefault(symbol, []).append(index)
+            if not nonterminals:
+                queue.append(left)
+        generating = set()
+        while queue:
+            symbol = queue.pop()
+            if symbol in generating:
+                continue
+            generating.add(symbol)
+            for index in waiting.get(symbol, ()):
+                missing[index] -= 1
+                if missing[index] == 0:
+                    queue.append(rules[index][0])
+
+        start_symbol = rules[0][0]
+        if start_symbol not in generating:
+            raise ValueError(f"Стартовый символ {start_symbol} не выводит ни одной цепочки терминалов")
+
+        # Достижимые символы - по полезным правилам от стартового
+        useful = {}
+        for index, (left, right) in enumerate(rules):
+            if missing[index] == 0:
+                useful.setdefault(left, []).append(right)
+        reachable = {start_symbol}
+        stack = [start_symbol]
+        while stack:
+            left = stack.pop()
+            for right in useful[left]:
+                if (left, right) in words:
+                    continue
+                for symbol in right:
+                    if symbol not in reachable and not merged.is_terminal(symbol):
+                        reachable.add(symbol)
+                        stack.append(symbol)
+
+        reduced = CFGrammar()
+        for left, rights in useful.items():
+            if left in reachable:
+                for right in rights:
+                    reduced.add_rule(left, right, merged.weights.get((left, right)))
+        if verbose:
+            (symbols_before, rules_before), (symbols_after, rules_after) = self.size(), reduced.size()
+            print(f"Нетерминалов: {symbols_before} -> {symbols_after}, правил: {rules_before} -> {rules_after}")
+        return reduced
+
     def is_terminal(self, symbol):
         # Является ли символ терминалом
         return symbol not in self.rules
     
-    def to_cnf(self):
+    def to_cnf(self, keep_unary=False):
         # Преобразует грамматику в нормальную форму Хомского (CNF)
+        # keep_unary - Оставить единичные правила A -> B: CKYParser применяет их замыкание в каждой ячейке,
+        #              поэтому правые части B не копируются в A, а деревья сохраняют исходные цепочки.
+        #              Новый стартовый символ в этом случае не нужен. Правило A -> A остаётся и при компиляции
+        #              считается лексическим: так в трибанке записана пунктуация (, -> ,)
         cnf = CFGrammar() 
+        # Для взвешенной грамматики переносим вероятности правил: вспомогательные правила
+        # получают вероятность 1, а цепочки единичных правил - произведение вероятностей
+        probs = {rule: math.exp(lp) for rule, lp in self.rule_log_probs().items()} if self.weights else None
         
         # Шаг 1: Добавляем новый стартовый символ, если исходный встречается в правых частях
         start_symbol = next(iter(self.rules)) if self.rules else None
-        if start_symbol:
+        if start_symbol and not keep_unary:
             appears_on_right = False
             for left, rights in self.rules.items():
                 for right in rights:
@@ -55,7 +206,7 @@ class CFGrammar:
             
             if appears_on_right:
                 new_start = f"{start_symbol}'"
-                cnf.add_rule(new_start, (start_symbol,))
+                cnf.add_rule(new_start, (start_symbol,), 1.0 if probs else None)
                 start_symbol = new_start
         
         # Шаг 2: Удаляем правила с более чем 2 нетерминалами в правой части и обрабатываем терминалы
@@ -74,48 +225,437 @@ class CFGrammar:
                             new_var = f"T_{next_var_index}"
                             next_var_index += 1
                             terminal_rules[symbol] = new_var
-                            cnf.add_rule(new_var, (symbol,))
+                            cnf.add_rule(new_var, (symbol,), 1.0 if probs else None)
                         new_right.append(terminal_rules[symbol])
                     else:
                         new_right.append(symbol)
                 
+                prob = probs[(left, right)] if probs else None
                 if len(new_right) > 2:
                     current_left = left
                     while len(new_right) > 2:
                         new_var = f"X_{next_var_index}"
                         next_var_index += 1
-                        cnf.add_rule(current_left, (new_right[0], new_var))
+                        cnf.add_rule(current_left, (new_right[0], new_var), prob)
+                        prob = 1.0 if probs else None
                         current_left = new_var
                         new_right = new_right[1:]
-                    cnf.add_rule(current_left, tuple(new_right))
+                    cnf.add_rule(current_left, tuple(new_right), prob)
                 else:
-                    cnf.add_rule(left, tuple(new_right))
+                    cnf.add_rule(left, tuple(new_right), prob)
         
-        # Шаг 3: Удаление unit_productions (единичных правил A -> B, где B - нетерминал)
-        unit_productions = []
+        # Шаг 3: Удаление unit_productions (единичных правил A -> B, где B - нетерминал).
+        # Для каждого A один раз обходим граф единичных правил (каждая пара A, B обрабатывается
+        # один раз, циклы не зацикливают обход) и копируем в A неединичные правила всех достижимых B
+        def is_unit(right):
+            return len(right) == 1 and not self.is_terminal(right[0])
+
+        unit_graph = {}
         for left, rights in cnf.rules.items():
             for right in rights:
-                if len(right) == 1 and not self.is_terminal(right[0]):
-                    unit_productions.append((left, right[0]))
-        
-        while unit_productions:
-            left, right_nt = unit_productions.pop(0)
-            for right in cnf.get_rules(right_nt):
-                if len(right) == 1 and not self.is_terminal(right[0]):
-                    unit_productions.append((left, right[0]))
-                else:
-                    cnf.add_rule(left, right)
-            
-            if (right_nt,) in cnf.rules.get(left, []):
-                cnf.rules[left].remove((right_nt,))
-        
-        cnf.rules = {k: v for k, v in cnf.rules.items() if v}  # Удаляем пустые правила
+                if is_unit(right):
+                    unit_graph.setdefault(left, []).append(right[0])
+        if not unit_graph or keep_unary:
+            return cnf
+
+        weights = cnf.weights if probs else None
+        result = CFGrammar()
+        for left, rights in cnf.rules.items():
+            for right in rights:
+                if not is_unit(right):
+                    result.add_rule(left, right, weights[(left, right)] if probs else None)
+            if left not in unit_graph:
+                continue
+            for target, chain_prob in self._unit_closure(unit_graph, left, weights):
+                for right in cnf.get_rules(target):
+                    if not is_unit(right):
+                        result.add_rule(left, right, chain_prob * weights[(target, right)] if probs else None)
         
-        return cnf
+        return result
+
+    @staticmethod
+    def _unit_closure(unit_graph, start, weights=None):
+        """
+        Нетерминалы, выводимые из start цепочками единичных правил, в порядке обхода.
+        Для взвешенной грамматики обход идёт от самых вероятных цепочек (алгоритм Дейкстры),
+        без весов - в ширину.
+        :return: Список пар (нетерминал, вероятность лучшей цепочки или 1.0)
+        """
+        best = {start: 1.0}
+        done = set()
+        closure = []
+        heap = [(-1.0, 0, start)]
+        counter = 1
+        while heap:
+            neg_prob, _, symbol = heapq.heappop(heap)
+            if symbol in done:
+                continue
+            done.add(symbol)
+            if symbol != start:
+                closure.append((symbol, -neg_prob))
+            for target in unit_graph.get(symbol, ()):
+                prob = -neg_prob * weights.get((symbol, (target,)), 0.0) if weights else 1.0
+                if target not in done and prob > best.get(target, 0.0):
+                    best[target] = prob
+                    heapq.heappush(heap, (-prob, counter, target))
+                    counter += 1
+        return closure
 
     def save_grammar(self, filename):
         # Сохраняет грамматику в файл
         with open(filename, 'w', encoding='utf8') as file:
             for left, rights in self.rules.items():
-                right_side = ' | '.join([' '.join(prod) for prod in rights])
-                file.write(f"{left} -> {right_side}\n")
\ No newline at end of file
+                right_side = ' | '.join([self.format_production(left, prod) for prod in rights])
+                file.write(f"{left} -> {right_side}\n")
+
+    def compile(self):
+        # Компилирует грамматику в индексы для CKY-разбора (грамматика должна быть в CNF)
+        return CompiledGrammar(self)
+
+
+def collapse_symbol(symbol):
+    # Базовая категория нетерминала трибанка: NP-SBJ-40, NP-SBJ=3 -> NP; -NONE-, -LRB- не меняются
+    if symbol.startswith('-'):
+        return symbol
+    match = TAG_PATTERN.match(symbol)
+    return match.group(1) if match else symbol
+
+
+def coarse_symbol(symbol):
+    # Символ грубой грамматики: вспомогательные символы CNF сливаются в T_ и X_, остальные - базовая категория
+    match = HELPER_PATTERN.match(symbol)
+    return match.group(1) if match else collapse_symbol(symbol)
+
+
+class CompiledGrammar:
+    MAGIC = b'CFGC'
+    VERSION = 2
+    # Массивы правил: имя -> тип элементов (array/memoryview)
+    ARRAYS = (('lexical_word', 'i'), ('lexical_lhs', 'i'), ('lexical_score', 'd'),
+              ('binary_lhs', 'i'), ('binary_left', 'i'), ('binary_right', 'i'), ('binary_score', 'd'),
+              ('unary_lhs', 'i'), ('unary_child', 'i'), ('unary_score', 'd'))
+
+    def __init__(self, grammar=None):
+        """
+        Индексированное представление грамматики в нормальной форме Хомского.
+        Строится один раз и используется парсером при каждом разборе.
+        Правила хранятся как целочисленные массивы (id символов и слов), по ним строятся словари-индексы.
+        grammar - Грамматика (CFGrammar) в нормальной форме Хомского, возможно с единичными правилами
+                  A -> B (to_cnf(keep_unary=True))
+        """
+        self.start_symbol = None
+        self.symbols = []  # плотная нумерация нетерминалов: id -> символ
+        self.words = []  # нумерация терминалов: id -> слово
+        self.source_hash = None  # хэш исходной грамматики (для кэша на диске)
+        self.path = None  # файл, из которого загружена грамматика
+        self._fingerprint = None
+        for name, typecode in self.ARRAYS:
+            setattr(self, name, array.array(typecode))
+
+        if grammar is not None:
+            self._from_grammar(grammar)
+            self._build_indexes()
+
+    def _from_grammar(self, grammar):
+        if not all(len(right) <= 2 for rights in grammar.rules.values() for right in rights):
+            raise ValueError("Грамматика должна быть в форме Хомского для CKY-разбора")
+
+        self.start_symbol = next(iter(grammar.rules)) if grammar.rules else None
+        symbol_ids = {}
+        word_ids = {}
+
+        def intern(ids, names, name):
+            if name not in ids:
+                ids[name] = len(names)
+                names.append(name)
+            return ids[name]
+
+        log_probs = grammar.rule_log_probs()
+        for left, rights in grammar.rules.items():
+            for right in dict.fromkeys(rights):
+                if len(right) == 1 and right[0] in grammar.rules and right[0] != left:
+                    self.unary_lhs.append(intern(symbol_ids, self.symbols, left))
+                    self.unary_child.append(intern(symbol_ids, self.symbols, right[0]))
+                    self.unary_score.append(log_probs[(left, right)])
+                elif len(right) == 1:  # A -> слово; A -> A - тоже слово (пунктуация трибанка: , -> ,)
+                    self.lexical_lhs.append(intern(symbol_ids, self.symbols, left))
+                    self.lexical_word.append(intern(word_ids, self.words, right[0]))
+                    self.lexical_score.append(log_probs[(left, right)])
+                elif len(right) == 2:
+                    self.binary_lhs.append(intern(symbol_ids, self.symbols, left))
+                    self.binary_left.append(intern(symbol_ids, self.symbols, right[0]))
+                    self.binary_right.append(intern(symbol_ids, self.symbols, right[1]))
+                    self.binary_score.append(log_probs[(left, right)])
+
+    def _build_indexes(self):
+        # Словари для CKY строятся по массивам правил
+        symbols = self.symbols
+        words = self.words
+        self.symbol_ids = {symbol: i for i, symbol in enumerate(symbols)}  # символ -> id
+        self.lexicon = {}  # слово -> [A, ...] для правил A -> слово
+        self.binary = {}  # B -> {C: [A, ...]} для правил A -> B C
+        self.lexicon_scores = {}  # слово -> [(A, log P), ...]
+        self.binary_scores = {}  # B -> {C: [(A, log P), ...]}
+        self.unary = {}  # B -> [A, ...] для единичных правил A -> B
+        self.unary_scores = {}  # B -> [(A, log P), ...]
+
+        for word, left, score in zip(self.lexical_word, self.lexical_lhs, self.lexical_score):
+            word = words[word]
+            left = symbols[left]
+            self.lexicon.setdefault(word, []).append(left)
+            self.lexicon_scores.setdefault(word, []).append((left, score))
+
+        for left, B, C, score in zip(self.binary_lhs, self.binary_left, self.binary_right, self.binary_score):
+            left = symbols[left]
+            B = symbols[B]
+            C = symbols[C]
+            self.binary.setdefault(B, {}).setdefault(C, []).append(left)
+            self.binary_scores.setdefault(B, {}).setdefault(C, []).append((left, score))
+
+        for left, child, score in zip(self.unary_lhs, self.unary_child, self.unary_score):
+            left = symbols[left]
+            child = symbols[child]
+            self.unary.setdefault(child, []).append(left)
+            self.unary_scores.setdefault(child, []).append((left, score))
+        # B -> [(A, P, log P цепочки, log P правила A -> P), ...] - см. _unary_closure
+        self.unary_closure = {child: self._unary_closure(child) for child in self.unary_scores}
+
+    def _unary_closure(self, symbol):
+        """
+        Символы, из которых symbol выводится цепочкой единичных правил A -> P -> ... -> symbol.
+        Для каждого A берётся самая вероятная цепочка (алгоритм Дейкстры), правила с нулевой вероятностью
+        не используются. Цепочка восстанавливается по P: лучшая цепочка P тоже есть в списке.
+        :return: Список (A, P, log P цепочки, log P правила A -> P) в порядке убывания log P цепочки
+        """
+        best = {symbol: 0.0}
+        found = {}
+        done = set()
+        closure = []
+        heap = [(-0.0, 0, symbol)]
+        counter = 1
+        while heap:
+            neg_score, _, child = heapq.heappop(heap)
+            if child in done:
+                continue
+            done.add(child)
+            if child != symbol:
+                closure.append(found[child])
+            for parent, rule_score in self.unary_scores.get(child, ()):
+                score = -neg_score + rule_score
+                if parent not in done and score > best.get(parent, -math.inf):
+                    best[parent] = score
+                    found[parent] = (parent, child, score, rule_score)
+                    heapq.heappush(heap, (-score, counter, parent))
+                    counter += 1
+        return closure
+
+    def compile(self):
+        # Грамматика уже скомпилирована
+        return self
+
+    def project(self, mapping=coarse_symbol):
+        """
+        Грубая грамматика для разбора от грубого к точному: каждый символ заменяется на mapping(symbol),
+        совпавшие правила объединяются. Правилу грубой грамматики достаётся наибольший log P из объединённых,
+        поэтому оценка грубого вывода не меньше оценки любого точного вывода, который в него проецируется.
+        :return: (грубая CompiledGrammar, словарь символ -> грубый символ)
+        """
+        projection = {symbol: mapping(symbol) for symbol in self.symbols}
+        symbols = self.symbols
+        lexical = {}  # (грубый символ, id слова) -> log P
+        for word, left, score in zip(self.lexical_word, self.lexical_lhs, self.lexical_score):
+            key = (projection[symbols[left]], word)
+            lexical[key] = max(lexical.get(key, -math.inf), score)
+        binary = {}  # (A, B, C) грубой грамматики -> log P
+        for left, B, C, score in zip(self.binary_lhs, self.binary_left, self.binary_right, self.binary_score):
+            key = (projection[symbols[left]], projection[symbols[B]], projection[symbols[C]])
+            binary[key] = max(binary.get(key, -math.inf), score)
+        unary = {}  # (A, B) грубой грамматики -> log P; правила, ставшие A -> A, отбрасываются
+        for left, child, score in zip(self.unary_lhs, self.unary_child, self.unary_score):
+            key = (projection[symbols[left]], projection[symbols[child]])
+            if key[0] != key[1]:
+                unary[key] = max(unary.get(key, -math.inf), score)
+
+        coarse = CompiledGrammar()
+        coarse.start_symbol = projection.get(self.start_symbol)
+        coarse.words = list(self.words)
+        symbol_ids = {}
+
+        def intern(symbol):
+            if symbol not in symbol_ids:
+                symbol_ids[symbol] = len(coarse.symbols)
+                coarse.symbols.append(symbol)
+            return symbol_ids[symbol]
+
+        for (left, word), score in lexical.items():
+            coarse.lexical_lhs.append(intern(left))
+            coarse.lexical_word.append(word)
+            coarse.lexical_score.append(score)
+        for (left, B, C), score in binary.items():
+            coarse.binary_lhs.append(intern(left))
+            coarse.binary_left.append(intern(B))
+            coarse.binary_right.append(intern(C))
+            coarse.binary_score.append(score)
+        for (left, child), score in unary.items():
+            coarse.unary_lhs.append(intern(left))
+            coarse.unary_child.append(intern(child))
+            coarse.unary_score.append(score)
+        coarse._build_indexes()
+        return coarse, projection
+
+    def fingerprint(self):
+        # Хэш грамматики для ключей кэша разборов: хэш исходного файла, если он известен, иначе хэш правил
+        if self._fingerprint is None:
+            if self.source_hash:
+                self._fingerprint = self.source_hash
+            else:
+                digest = hashlib.sha256(json.dumps([self.start_symbol, self.symbols, self.words],
+                                                   ensure_ascii=False).encode('utf8'))
+                for name, _ in self.ARRAYS:
+                    digest.update(getattr(self, name))
+                self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def left_corners(self, symbol):
+        """
+        Символы, с которых может начинаться вывод symbol: сам symbol и все B, достижимые
+        по левым потомкам правил A -> B C и единичных правил A -> B. Результат кэшируется.
+        """
+        if not hasattr(self, '_left_corners'):
+            self._left_corners = {}
+            self._left_children = {}
+            for B, by_right in self.binary.items():
+                for lefts in by_right.values():
+                    for left in lefts:
+                        self._left_children.setdefault(left, set()).add(B)
+            for B, lefts in self.unary.items():
+                for left in lefts:
+                    self._left_children.setdefault(left, set()).add(B)
+        corners = self._left_corners.get(symbol)
+        if corners is None:
+            found = {symbol}
+            stack = [symbol]
+            while stack:
+                for child in self._left_children.get(stack.pop(), ()):
+                    if child not in found:
+                        found.add(child)
+                        stack.append(child)
+            corners = self._left_corners[symbol] = frozenset(found)
+        return corners
+
+    def save(self, filename, source_hash=None):
+        """
+        Сохраняет грамматику в бинарном формате: заголовок (магическое число, версия, хэш исходника,
+        JSON с таблицами символов) и выровненные массивы правил, пригодные для mmap.
+        """
+        self.source_hash = source_hash or self.source_hash or ''
+        offset = 0
+        layout = {}
+        for name, _ in self.ARRAYS:
+            data = getattr(self, name)
+            layout[name] = [offset, len(data)]
+            offset += len(data) * data.itemsize
+        header = json.dumps({'start': self.start_symbol, 'symbols': self.symbols, 'words': self.words,
+                             'arrays': layout}, ensure_ascii=False).encode('utf8')
+        data_start = _align(16 + 64 + 8 + len(header))
+
+        # запись во временный файл и замена: процессы, отобразившие прежний файл через mmap (load),
+        # продолжают читать его содержимое, а не получают SIGBUS на перезаписанном файле
+        tmp_path = f"{filename}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as file:
+                file.write(self.MAGIC + struct.pack('<I', self.VERSION) + b'\0' * 8)
+                file.write(self.source_hash.encode('ascii').ljust(64, b'\0'))
+                file.write(struct.pack('<Q', len(header)) + header)
+                file.write(b'\0' * (data_start - file.tell()))
+                for name, _ in self.ARRAYS:
+                    file.write(getattr(self, name))
+            os.replace(tmp_path, filename)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.path = filename
+
+    @classmethod
+    def read_hash(cls, filename):
+        # Читает хэш исходной грамматики из заголовка (None, если файл не нашего формата)
+        with open(filename, 'rb') as file:
+            prefix = file.read(16 + 64)
+        if len(prefix) < 80 or prefix[:4] != cls.MAGIC or struct.unpack('<I', prefix[4:8])[0] != cls.VERSION:
+            return None
+        return prefix[16:].rstrip(b'\0').decode('ascii')
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Загружает бинарную грамматику через mmap: массивы правил не копируются в память процесса,
+        и несколько процессов делят одни и те же страницы файла.
+        """
+        source_hash = cls.read_hash(filename)
+        if source_hash is None:
+            raise ValueError(f"{filename} не является скомпилированной грамматикой")
+        with open(filename, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header_len = struct.unpack('<Q', buffer[80:88])[0]
+        header = json.loads(bytes(buffer[88:88 + header_len]).decode('utf8'))
+        data_start = _align(88 + header_len)
+
+        compiled = cls()
+        compiled.start_symbol = header['start']
+        compiled.symbols = header['symbols']
+        compiled.words = header['words']
+        compiled.source_hash = source_hash
+        compiled.path = filename
+        view = memoryview(buffer)
+        for name, typecode in cls.ARRAYS:
+            offset, count = header['arrays'][name]
+            size = array.array(typecode).itemsize
+            start = data_start + offset
+            setattr(compiled, name, view[start:start + count * size].cast(typecode))
+        compiled._build_indexes()
+        return compiled
+
+    def __reduce__(self):
+        # Грамматика, сохранённая на диск, передаётся в другие процессы по пути к файлу
+        if self.path is not None:
+            return (CompiledGrammar.load, (self.path,))
+        return super().__reduce__()
+
+
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def grammar_hash(filename, to_cnf=False, keep_unary=False):
+    # Хэш содержимого текстовой грамматики с учётом версии формата и преобразования в CNF
+    digest = hashlib.sha256(f"v{CompiledGrammar.VERSION};cnf={to_cnf};unary={keep_unary};".encode('ascii'))
+    with open(filename, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_compiled(filename, to_cnf=False, keep_unary=False):
+    """
+    Возвращает скомпилированную грамматику из кэша рядом с текстовым файлом (filename.cfgc).
+    Кэш пересобирается, если хэш текстовой грамматики изменился.
+    filename - Текстовая грамматика
+    to_cnf - Преобразовать грамматику в нормальную форму Хомского перед компиляцией
+    keep_unary - При преобразовании оставить единичные правила (см. CFGrammar.to_cnf)
+    """
+    keep_unary = bool(to_cnf and keep_unary)
+    cache_path = filename + ('.cnf' if to_cnf else '') + ('.unary' if keep_unary else '') + '.cfgc'
+    source_hash = grammar_hash(filename, to_cnf, keep_unary)
+    if os.path.exists(cache_path) and CompiledGrammar.read_hash(cache_path) == source_hash:
+        return CompiledGrammar.load(cache_path)
+
+    grammar = CFGrammar(filename)
+    if to_cnf:
+        grammar = grammar.to_cnf(keep_unary=keep_unary)
+    compiled = grammar.compile()
+    try:
+        compiled.save(cache_path, source_hash)
+    except OSError:
+        compiled.path = None  # каталог только для чтения - работаем без кэша
+    return compiled
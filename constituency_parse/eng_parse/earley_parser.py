@@ -0,0 +1,195 @@
+from cky_parser import CKYParser
+
+
+class EarleyChart:
+    def __init__(self, n):
+        """
+        Таблица алгоритма Эрли для предложения длины n.
+        Элемент (узел дерева правил, начало) лежит в наборе той позиции, где он заканчивается.
+        """
+        self.n = n
+        self.items = [[] for _ in range(n + 1)]  # items[j] - элементы, заканчивающиеся в j
+        self.index = [{} for _ in range(n + 1)]  # элемент -> номер в items[j]
+        # back[j][p] - как получен элемент items[j][p]: None (предсказан) или
+        # (k, номер предыдущего элемента в items[k], потомок: слово или (символ, начало))
+        self.back = [[] for _ in range(n + 1)]
+        self.waiting = [{} for _ in range(n + 1)]  # waiting[j][X] - номера элементов в j, ожидающих X
+        self.completed = [{} for _ in range(n + 1)]  # completed[j][(X, i)] - первый элемент, завершивший X на [i, j)
+
+    def add(self, j, item, back):
+        # Добавляет элемент в набор j, если его там ещё нет
+        index = self.index[j]
+        if item not in index:
+            index[item] = len(self.items[j])
+            self.items[j].append(item)
+            self.back[j].append(back)
+
+    def __contains__(self, constituent):
+        # Найдена ли составляющая (символ, начало, конец)
+        symbol, i, j = constituent
+        return (symbol, i) in self.completed[j]
+
+    def children(self, symbol, i, j):
+        # Потомки первого найденного вывода составляющей: слова и тройки (символ, начало, конец)
+        p = self.completed[j][(symbol, i)]
+        children = []
+        back = self.back[j][p]
+        while back is not None:
+            k, p, child = back
+            children.append(child if isinstance(child, str) else (child[0], child[1], j))
+            j = k
+            back = self.back[j][p]
+        children.reverse()
+        return children
+
+
+class EarleyParser:
+    def __init__(self, grammar):
+        """
+        Парсер Эрли, работающий с исходной КС-грамматикой без приведения к форме Хомского:
+        не появляются вспомогательные символы T_*, X_* и копии правил от удаления единичных правил.
+        Правые части правил одного нетерминала хранятся префиксным деревом, поэтому правила с общим
+        началом (NP -> DT NN, NP -> DT NN NN, ...) дают один элемент таблицы, а не по элементу на правило.
+        Символы предсказываются, только если следующее слово может начинать их вывод (таблица левых углов),
+        а завершённые элементы находят ожидающие их элементы по индексу (позиция, символ).
+        grammar - Грамматика CFGrammar (пустые правила не поддерживаются и пропускаются, как в to_cnf)
+        """
+        self.grammar = grammar
+        self.options = {}  # для parse_many: парсер пересоздаётся в рабочих процессах
+        self.start_symbol = next(iter(grammar.rules)) if grammar.rules else None
+        # узлы префиксного дерева правых частей; узел - пройденная часть правила (точка в правиле)
+        self.roots = {}  # нетерминал -> корневой узел (точка в начале правил)
+        self.node_lhs = []  # узел -> левая часть правил
+        self.node_next = []  # узел -> {следующий символ: узел}
+        self.node_final = []  # заканчивается ли в узле какое-либо правило
+        self._left_parents = {}  # символ X -> нетерминалы A с правилами A -> X ...
+        for left, rights in grammar.rules.items():
+            root = self.roots[left] = self._new_node(left)
+            for right in rights:
+                if not right:
+                    continue
+                node = root
+                for symbol in right:
+                    child = self.node_next[node].get(symbol)
+                    if child is None:
+                        child = self.node_next[node][symbol] = self._new_node(left)
+                    node = child
+                self.node_final[node] = True
+                self._left_parents.setdefault(right[0], set()).add(left)
+        # следующие нетерминалы узла и переходы по словам - отдельно, чтобы не проверять тип символа при разборе
+        self.node_nonterminals = [tuple(symbol for symbol in next_symbols if symbol in grammar.rules)
+                                  for next_symbols in self.node_next]
+        self.node_words = [{symbol: child for symbol, child in next_symbols.items() if symbol not in grammar.rules}
+                           for next_symbols in self.node_next]
+        self._starters = {}  # слово -> нетерминалы, вывод которых может начинаться с этого слова
+
+    def _new_node(self, left):
+        self.node_lhs.append(left)
+        self.node_next.append({})
+        self.node_final.append(False)
+        return len(self.node_lhs) - 1
+
+    def starters(self, word):
+        # Нетерминалы, из которых выводится цепочка, начинающаяся с word (замыкание левых углов, кэшируется)
+        found = self._starters.get(word)
+        if found is None:
+            found = set()
+            stack = [word]
+            while stack:
+                for parent in self._left_parents.get(stack.pop(), ()):
+                    if parent not in found:
+                        found.add(parent)
+                        stack.append(parent)
+            found = self._starters[word] = frozenset(found)
+        return found
+
+    def parse(self, sentence):
+        """
+        Разбирает предложение алгоритмом Эрли. Элемент таблицы - пара (узел дерева правил, начало).
+        sentence - Список токенов (слов) предложения
+        :return: (можно ли разобрать, таблица EarleyChart)
+        """
+        n = len(sentence)
+        chart = EarleyChart(n)
+        if n == 0 or self.start_symbol is None:
+            return False, chart
+        node_lhs = self.node_lhs
+        node_next = self.node_next
+        node_final = self.node_final
+        node_nonterminals = self.node_nonterminals
+        node_words = self.node_words
+        roots = self.roots
+
+        if self.start_symbol in self.starters(sentence[0]):
+            chart.add(0, (roots[self.start_symbol], 0), None)
+
+        for j in range(n + 1):
+            items = chart.items[j]
+            waiting = chart.waiting[j]
+            completed = chart.completed[j]
+            word = sentence[j] if j < n else None
+            starters = self.starters(word) if j < n else frozenset()
+            predicted = set()
+            p = 0
+            while p < len(items):  # набор растёт по ходу обработки
+                node, origin = items[p]
+                if node_final[node]:
+                    # завершение: без пустых правил origin < j, поэтому набор origin уже полон
+                    key = (node_lhs[node], origin)
+                    if key not in completed:
+                        completed[key] = p
+                        origin_items = chart.items[origin]
+                        for q in chart.waiting[origin].get(key[0], ()):
+                            node2, origin2 = origin_items[q]
+                            chart.add(j, (node_next[node2][key[0]], origin2), (origin, q, key))
+                for symbol in node_nonterminals[node]:
+                    if symbol in starters:
+                        waiting.setdefault(symbol, []).append(p)
+                        if symbol not in predicted:
+                            predicted.add(symbol)
+                            chart.add(j, (roots[symbol], j), None)
+                if word is not None:
+                    child = node_words[node].get(word)
+                    if child is not None:
+                        chart.add(j + 1, (child, origin), (j, p, word))
+                p += 1
+
+        return (self.start_symbol, 0, n) in chart, chart
+
+    def extract_parse_tree(self, sentence, chart):
+        """
+        Восстанавливает дерево разбора по первому найденному выводу каждой составляющей.
+        Обход без рекурсии, поэтому глубина дерева не упирается в предел рекурсии Python.
+        :return: Вложенный кортеж в формате CKYParser (слова - строки) или None
+        """
+        n = len(sentence)
+        if not n or (self.start_symbol, 0, n) not in chart:
+            return None
+        stack = [(self.start_symbol, chart.children(self.start_symbol, 0, n)[::-1], [])]
+        while True:
+            symbol, pending, built = stack[-1]
+            if pending:
+                child = pending.pop()
+                if isinstance(child, str):
+                    built.append(child)
+                else:
+                    stack.append((child[0], chart.children(*child)[::-1], []))
+                continue
+            stack.pop()
+            tree = (symbol, *built)
+            if not stack:
+                return tree
+            stack[-1][2].append(tree)
+
+    def parse_tree(self, sentence):
+        """
+        Разбирает предложение и сразу восстанавливает дерево.
+        :return: (можно ли разобрать, дерево разбора или None)
+        """
+        can_parse, chart = self.parse(sentence)
+        return can_parse, self.extract_parse_tree(sentence, chart)
+
+    # пакетный разбор и вывод деревьев общие с CKYParser
+    parse_many = CKYParser.parse_many
+    format_parse_tree = CKYParser.format_parse_tree
+    print_parse_tree = CKYParser.print_parse_tree
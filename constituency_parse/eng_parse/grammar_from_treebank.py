@@ -1,28 +1,176 @@
-import nltk
-from nltk.corpus import treebank
+import argparse
+import hashlib
+import os
+import pickle
 import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import nltk
+from nltk import Tree
+
+from cfg import CFGrammar
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TREEBANK_FILES = r'wsj_.*\.mrg'  # файлы трибанка Penn (как в nltk.corpus.treebank)
+PARENS = re.compile(r'[()]')
+
 
 def clean_nonterm(nonterm):
     return re.sub(r'\|<.*?>', '', nonterm)
 
-def cfg_from_treebank():
-    nltk.download("treebank")
-    grammar = {}
-    for tree in treebank.parsed_sents():
-        tree.chomsky_normal_form()  
-        productions = tree.productions()
-        for prod in productions:
-            lhs = clean_nonterm(str(prod.lhs()))  
-            rhs = tuple(clean_nonterm(str(sym)) for sym in prod.rhs())  
+def treebank_root():
+    # Локальный каталог трибанка из nltk_data (без обращения к сети)
+    try:
+        return nltk.data.find('corpora/treebank/combined').path
+    except LookupError:
+        raise ValueError("Трибанк не найден в nltk_data: загрузите его один раз через nltk.download('treebank') "
+                         "или укажите каталог с файлами .mrg") from None
+
+def treebank_files(root, pattern=TREEBANK_FILES):
+    # Файлы трибанка в каталоге root в порядке имён
+    return sorted(name for name in os.listdir(root) if re.fullmatch(pattern, name))
+
+def read_trees(path):
+    """
+    Деревья файла трибанка в скобочной записи Penn: ( (S (NP-SBJ (DT The) ...) ...) ).
+    Разбираются так же, как в nltk.corpus.treebank (BracketParseCorpusReader), но файл читается напрямую,
+    поэтому каталог не обязан лежать в nltk_data.
+    """
+    with open(path, encoding='utf8') as file:
+        text = file.read()
+    depth = 0
+    start = 0
+    for match in PARENS.finditer(text):
+        if match.group() == '(':
+            if depth == 0:
+                start = match.start()
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                block = re.sub(r"\((.)\)", r"(\1 \1)", text[start:match.end()])  # (,) -> (, ,)
+                block = re.sub(r"\(([^\s()]+) ([^\s()]+) [^\s()]+\)", r"(\1 \2)", block)
+                tree = Tree.fromstring(block)
+                yield tree[0] if tree.label() == '' and len(tree) == 1 else tree  # внешние скобки без метки
+
+def count_tree(tree, counts):
+    # Добавляет в counts правила одного дерева после приведения к бинарной форме: (lhs, rhs) -> частота
+    tree.chomsky_normal_form()
+    for prod in tree.productions():
+        lhs = clean_nonterm(str(prod.lhs()))
+        rhs = tuple(clean_nonterm(str(sym)) for sym in prod.rhs())
+        counts[(lhs, rhs)] += 1  # частоты правил нужны для PCFG
+
+def count_productions(root, fileid):
+    # Частоты правил одного файла трибанка (шаг map; выполняется в рабочем процессе)
+    counts = Counter()
+    for tree in read_trees(os.path.join(root, fileid)):
+        count_tree(tree, counts)
+    return counts
 
-            if lhs not in grammar:
-                grammar[lhs] = set()
-            grammar[lhs].add(rhs)
+def merge_counts(grammar, counts):
+    # Добавляет частоты файла к грамматике {lhs: Counter(rhs)} (шаг reduce)
+    for (lhs, rhs), count in counts.items():
+        if lhs not in grammar:
+            grammar[lhs] = Counter()
+        grammar[lhs][rhs] += count
+    return grammar
+
+def cfg_from_treebank(root=None, workers=1, state_path=None):
+    """
+    Собирает грамматику с частотами правил по локальным файлам трибанка.
+    Файлы читаются потоком и распределяются между рабочими процессами; частоты каждого файла
+    считаются отдельно и сливаются в порядке имён файлов, поэтому результат не зависит от числа процессов.
+    root - Каталог с файлами .mrg (None - трибанк из nltk_data)
+    workers - Число процессов (1 - в текущем процессе)
+    state_path - Файл с частотами по файлам: при повторном запуске пересчитываются только новые
+                 и изменённые файлы, а частоты удалённых файлов вычитаются
+    :return: Словарь lhs -> Counter(rhs -> частота)
+    """
+    root = root or treebank_root()
+    fileids = treebank_files(root)
+    state = load_state(state_path, root) if state_path else {}
+    stamps = {fileid: _file_stamp(root, fileid) for fileid in fileids}
+    stale = [fileid for fileid in fileids if fileid not in state or state[fileid][0] != stamps[fileid]]
+
+    count = partial(count_productions, root)
+    if workers > 1 and len(stale) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunk_size = max(1, len(stale) // (4 * workers))
+            for fileid, counts in zip(stale, executor.map(count, stale, chunksize=chunk_size)):
+                state[fileid] = (stamps[fileid], counts)
+    else:
+        for fileid in stale:
+            state[fileid] = (stamps[fileid], count(fileid))
+    for fileid in set(state) - set(stamps):
+        del state[fileid]
 
+    if state_path and (stale or len(state) != len(fileids)):
+        save_state(state_path, root, state)
+    grammar = {}
+    for fileid in fileids:
+        merge_counts(grammar, state[fileid][1])
     return grammar
 
-def save_grammar(grammar, filename="eng_parse//cf_grammar.txt"):
+def _file_stamp(root, fileid):
+    stat = os.stat(os.path.join(root, fileid))
+    return stat.st_size, stat.st_mtime_ns
+
+def load_state(path, root):
+    # Частоты по файлам, сохранённые save_state (пусто, если файла нет или он от другого каталога)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'rb') as file:
+        saved = pickle.load(file)
+    return saved['files'] if saved['root'] == os.path.abspath(root) else {}
+
+def save_state(path, root, state):
+    # Сохраняет частоты по файлам: fileid -> ((размер, время изменения), Counter)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        pickle.dump({'root': os.path.abspath(root), 'files': state}, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+def save_grammar(grammar, filename=os.path.join(BASE_DIR, "cf_grammar.txt")):
     with open(filename, "w", encoding="utf-8") as f:
         for lhs, rhs_list in grammar.items():
-            rhs_str = " | ".join([" ".join(rhs) for rhs in rhs_list])
-            f.write(f"{lhs} -> {rhs_str}\n")
\ No newline at end of file
+            rhs_str = " | ".join([f"{' '.join(rhs)} [{count}]" for rhs, count in rhs_list.items()])
+            f.write(f"{lhs} -> {rhs_str}\n")
+
+def save_compiled(grammar, filename=os.path.join(BASE_DIR, "treebank.cfgc")):
+    """
+    Записывает грамматику сразу в компилированный формат (CompiledGrammar.load, CKYParser), минуя текст:
+    правила трибанка уже бинарные, единичные цепочки сохраняются (to_cnf(keep_unary=True)),
+    log P правил вычисляются по частотам.
+    :return: CompiledGrammar
+    """
+    cf_grammar = CFGrammar()
+    digest = hashlib.sha256()
+    for lhs, rhs_list in grammar.items():
+        for rhs, count in rhs_list.items():
+            cf_grammar.add_rule(lhs, rhs, count)
+            digest.update(f"{lhs}\t{' '.join(rhs)}\t{count}\n".encode('utf8'))
+    compiled = cf_grammar.to_cnf(keep_unary=True).compile()
+    compiled.save(filename, digest.hexdigest())
+    return compiled
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Induce a PCFG with rule counts from Penn treebank files')
+    arg_parser.add_argument('--treebank', help='directory with .mrg files (default: treebank in nltk_data)')
+    arg_parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help='number of processes')
+    arg_parser.add_argument('--state', help='per-file counts for incremental updates (recount only new or changed files)')
+    arg_parser.add_argument('-o', '--output', default=os.path.join(BASE_DIR, 'treebank.cfgc'), help='compiled grammar to write')
+    arg_parser.add_argument('--text', help='also write the grammar with counts in text format')
+    args = arg_parser.parse_args()
+
+    grammar = cfg_from_treebank(args.treebank, args.workers, args.state)
+    compiled = save_compiled(grammar, args.output)
+    if args.text:
+        save_grammar(grammar, args.text)
+    print(f"{len(compiled.symbols)} nonterminals, {len(compiled.lexical_lhs)} lexical, "
+          f"{len(compiled.binary_lhs)} binary and {len(compiled.unary_lhs)} unary rules -> {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,102 @@
-import cfg, cky_parser
+import argparse
+import os
+import cfg, cky_parser, earley_parser, parse_cache
 from grammar_from_treebank import cfg_from_treebank, save_grammar
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # грамматики ищутся рядом со скриптом, а не в текущем каталоге
+
+def parse_file(parser, input_path, output_path, workers):
+    # Пакетный разбор: по предложению на строку во входном файле, по дереву на строку в выходном
+    with open(input_path, 'r', encoding='utf8') as fin, open(output_path, 'w', encoding='utf8') as fout:
+        sentences = (line.strip().split(' ') for line in fin)
+        for can_parse, parse_tree in parser.parse_many(sentences, workers=workers):
+            fout.write(parser.format_parse_tree(parse_tree) + "\n")
+
+def recognize_file(parser, input_path, output_path):
+    # Пакетная проверка без построения деревьев: True/False на строку в выходном файле
+    with open(input_path, 'r', encoding='utf8') as fin, open(output_path, 'w', encoding='utf8') as fout:
+        for line in fin:
+            fout.write(str(parser.recognize(line.strip().split(' '))) + "\n")
+
+def incremental_loop(parser):
+    # Пошаговый ввод: по токену на строку, '-' отменяет последний токен, пустая строка завершает предложение
+    state = parser.incremental()
+    while True:
+        token = input("Next token ('-' to undo, empty line to finish): ").strip()
+        if token == '-':
+            if state.tokens:
+                state.pop()
+            print(f"Prefix: {' '.join(state.tokens)}")
+            continue
+        if not token:
+            can_parse, parse_table, backpointers = state.result()
+            if can_parse:
+                parser.print_parse_tree(parser.extract_parse_tree(state.tokens, parse_table, backpointers))
+            else:
+                print("Sentence cannot be parsed.")
+            state = parser.incremental()
+            continue
+        viable = state.push(token)
+        print(("complete sentence" if state.can_parse() else "viable prefix") if viable else "no sentence starts like this")
+
 def main():
+    arg_parser = argparse.ArgumentParser(description='CKY constituency parser for English')
+    arg_parser.add_argument('-i', '--input', help='file with one sentence per line (batch mode)')
+    arg_parser.add_argument('-o', '--output', help='file to write one bracketed tree per line')
+    arg_parser.add_argument('-w', '--workers', type=int, default=1, help='number of parsing processes')
+    arg_parser.add_argument('--incremental', action='store_true', help='read one token per line and check the prefix after each')
+    arg_parser.add_argument('--earley', action='store_true', help='use the Earley parser on the original grammar (no CNF)')
+    arg_parser.add_argument('--cache', type=int, default=0, help='LRU cache size for repeated sentences and phrases (CKY, 0 - off)')
+    arg_parser.add_argument('--cache-file', help='keep the parse cache in this file between batch runs')
+    arg_parser.add_argument('--recognize', action='store_true', help='only check whether each sentence parses (CKY, writes True/False per line)')
+    arg_parser.add_argument('--wavefront', type=int, default=1, help='processes that share the chart of one long sentence (CKY)')
+    arg_parser.add_argument('--keep-unary', action='store_true', help='keep unary rules A -> B instead of eliminating them (CKY, smaller grammar, original unary chains in trees)')
+    args = arg_parser.parse_args()
+
     # grammar = cfg_from_treebank()
     # save_grammar(grammar)
     # grammar = cfg.CFGrammar('eng_parse//cfgrammar.txt').to_cnf()
     # grammar.save_grammar("eng_parse//cnf_grammar.txt")
-    grammar = cfg.CFGrammar("eng_parse//cnf_grammar.txt")
-    parser = cky_parser.CKYParser(grammar)
+    if args.earley:
+        if args.recognize:
+            arg_parser.error('--recognize is only supported by the CKY parser')
+        if args.incremental:
+            arg_parser.error('--incremental is only supported by the CKY parser')
+        parser = earley_parser.EarleyParser(cfg.CFGrammar(os.path.join(BASE_DIR, "cf_grammar.txt")))
+    else:
+        if args.cache and args.workers > 1:  # кэш не передаётся в процессы parse_many
+            arg_parser.error('--cache is not used by parallel workers, run it with -w 1')
+        if args.keep_unary:
+            grammar = cfg.load_compiled(os.path.join(BASE_DIR, "cf_grammar.txt"), to_cnf=True, keep_unary=True)
+        else:
+            grammar = cfg.load_compiled(os.path.join(BASE_DIR, "cnf_grammar.txt"))  # компилированный кэш рядом с текстом
+        cache = parse_cache.ParseCache(args.cache, path=args.cache_file) if args.cache else None
+        parser = cky_parser.CKYParser(grammar, cache=cache, wavefront_workers=args.wavefront)
+    if args.input and args.recognize:
+        recognize_file(parser, args.input, args.output or args.input + '.recognized')
+        return
+    if args.input:
+        parse_file(parser, args.input, args.output or args.input + '.parsed', args.workers)
+        if getattr(parser, 'cache', None) is not None:
+            print(f"Cache: {parser.cache.stats()}")
+            if parser.cache.path:
+                parser.cache.save()
+        return
+    if args.incremental:
+        incremental_loop(parser)
+        return
     while True:
         sentence = input("Enter sentence to parse: ").split(' ')
+        if args.earley:
+            can_parse, parse_tree = parser.parse_tree(sentence)
+            if can_parse:
+                parser.print_parse_tree(parse_tree)
+            else:
+                print("Sentence cannot be parsed.")
+            continue
+        if args.recognize:
+            print("Sentence can be parsed." if parser.recognize(sentence) else "Sentence cannot be parsed.")
+            continue
         can_parse, parse_table, backpointers = parser.parse(sentence)
         if can_parse:
             print("Sentence can be parsed.")
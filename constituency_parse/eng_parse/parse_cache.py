@@ -0,0 +1,79 @@
+import os
+import pickle
+from collections import OrderedDict
+
+
+class ParseCache:
+    KINDS = ("sentence", "span")
+
+    def __init__(self, max_entries=100000, min_span=2, path=None):
+        """
+        Ограниченный LRU-кэш результатов разбора.
+        Хранит деревья целых предложений и содержимое ячеек CKY-таблицы для подотрезков:
+        ячейка отрезка зависит только от его слов, поэтому повторяющиеся фразы внутри разных
+        предложений берутся из кэша. Ключ включает хэш грамматики и режим парсера (см. CKYParser).
+        max_entries - Наибольшее число записей (предложений и отрезков вместе)
+        min_span - Отрезки короче min_span слов (не меньше 2) не кэшируются: их дешевле посчитать заново
+        path - Файл для сохранения кэша между запусками (загружается, если существует)
+        """
+        if max_entries < 1:
+            raise ValueError("Размер кэша должен быть положительным")
+        if min_span < 2:
+            raise ValueError("Кэшируются только отрезки из двух и более слов")
+        self.max_entries = max_entries
+        self.min_span = min_span
+        self.path = path
+        self.entries = OrderedDict()  # (вид, ключ) -> значение, от давно использованных к недавним
+        self.hits = dict.fromkeys(self.KINDS, 0)
+        self.misses = dict.fromkeys(self.KINDS, 0)
+        self.evictions = 0
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def lookup(self, kind, key):
+        # Значение из кэша или None; найденная запись становится самой свежей
+        value = self.entries.get((kind, key))
+        if value is None:
+            self.misses[kind] += 1
+            return None
+        self.entries.move_to_end((kind, key))
+        self.hits[kind] += 1
+        return value
+
+    def store(self, kind, key, value):
+        # Добавляет запись, вытесняя самые давно использованные при переполнении
+        self.entries[(kind, key)] = value
+        self.entries.move_to_end((kind, key))
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        # Счётчики попаданий, промахов и вытеснений для подбора размера кэша
+        stats = {"entries": len(self.entries), "max_entries": self.max_entries, "evictions": self.evictions}
+        for kind in self.KINDS:
+            stats[f"{kind}_hits"] = self.hits[kind]
+            stats[f"{kind}_misses"] = self.misses[kind]
+        return stats
+
+    def save(self, path=None):
+        # Сохраняет записи на диск (счётчики не сохраняются)
+        path = path or self.path
+        if not path:
+            raise ValueError("Не указан файл для сохранения кэша")
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(list(self.entries.items()), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        # Загружает записи, сохранённые save (самые старые отбрасываются, если кэш теперь меньше)
+        with open(path, 'rb') as file:
+            items = pickle.load(file)
+        self.entries = OrderedDict(items[-self.max_entries:])
@@ -0,0 +1,315 @@
+"""
+Оценка точности и скорости разбора составляющих по эталонным деревьям (PARSEVAL).
+
+Запуск из каталога constituency_parse:
+    python evaluate.py --gold heldout_treebank --grammar eng_parse/treebank.cfgc --parsers cky-pcfg --workers 4
+    python evaluate.py --gold heldout_treebank --parsers cky-pcfg --beams 5 10 20 --timeout 30 --output eval.json
+    python evaluate.py --lang rus --gold rus_gold.txt --parsers cky cky-coarse
+
+Эталон - каталог с файлами трибанка .mrg или файл с деревьями в скобочной записи (например, вывод main.py).
+Для честной оценки он не должен пересекаться с файлами, по которым индуцирована грамматика
+(grammar_from_treebank.py). Предложение - листья эталонного дерева; парсеры из benchmark.PARSERS
+разбирают его в пуле процессов с ограничением времени на предложение. Считаются помеченные
+скобки (precision, recall, F1) и точное совпадение, а также пропускная способность и задержки
+по длинам предложений, так что компромиссы скорость/точность (beam, threshold, грубый проход)
+сравниваются в одном отчёте.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import signal
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, 'eng_parse'))  # код грамматики одинаков для eng_parse и rus_parse
+
+import cfg
+import cky_parser
+from benchmark import LANGUAGES, PARSERS
+from grammar_from_treebank import TREEBANK_FILES, clean_nonterm, read_trees, treebank_files
+
+
+class SentenceTimeout(Exception):
+    # Разбор предложения не уложился в отведённое время
+    pass
+
+
+def tree_to_tuple(tree):
+    # nltk.Tree -> вложенный кортеж в формате CKYParser: (символ, потомки...), слова - строки
+    if isinstance(tree, str):
+        return tree
+    return (tree.label(), *(tree_to_tuple(child) for child in tree))
+
+
+def read_gold(path, pattern=TREEBANK_FILES, binarize=True):
+    """
+    Эталонные деревья из каталога трибанка (файлы по шаблону pattern в порядке имён) или из одного файла.
+    binarize - Привести деревья к бинарной форме так же, как при индукции грамматики (grammar_from_treebank),
+               чтобы скобки эталона и разбора сравнивались в пространстве символов грамматики
+    :return: Список вложенных кортежей
+    """
+    paths = [os.path.join(path, name) for name in treebank_files(path, pattern)] if os.path.isdir(path) else [path]
+    trees = []
+    for file_path in paths:
+        for tree in read_trees(file_path):
+            if binarize:
+                tree.chomsky_normal_form()
+                for subtree in tree.subtrees():
+                    subtree.set_label(clean_nonterm(subtree.label()))
+            trees.append(tree_to_tuple(tree))
+    return trees
+
+
+def brackets(tree, labels='base'):
+    """
+    Помеченные скобки дерева: Counter (метка, начало, конец).
+    Как в PARSEVAL, не учитываются части речи (узлы над одним словом); вспомогательные символы CNF
+    (T_*, X_*) и новый стартовый символ S' тоже не считаются - их потомки поднимаются к родителю.
+    labels - 'base' - базовые категории (NP-SBJ-40 -> NP), 'raw' - метки как есть
+    """
+    result = Counter()
+    if tree is None:
+        return result
+    if len(tree) == 2 and not isinstance(tree[1], str) and tree[0].endswith("'"):
+        tree = tree[1]  # S' -> S
+    # обход без рекурсии: (узел, начало, потомки уже обработаны); position - число пройденных слов
+    stack = [(tree, 0, False)]
+    position = 0
+    while stack:
+        node, start, done = stack.pop()
+        if isinstance(node, str):
+            position += 1
+            continue
+        if done:
+            label = node[0]
+            if not cfg.HELPER_PATTERN.match(label) and not (len(node) == 2 and isinstance(node[1], str)):
+                result[(cfg.collapse_symbol(label) if labels == 'base' else label, start, position)] += 1
+            continue
+        stack.append((node, position, True))
+        stack.extend((child, None, False) for child in reversed(node[1:]))
+    return result
+
+
+def leaves(tree):
+    # Слова дерева слева направо
+    words = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, str):
+            words.append(node)
+        else:
+            stack.extend(reversed(node[1:]))
+    return words
+
+
+def percentile(values, q):
+    # Перцентиль q (0-100) по ближайшему рангу
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def f1_score(matched, gold, predicted):
+    precision = matched / predicted if predicted else 0.0
+    recall = matched / gold if gold else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+_worker_parser = None  # парсер рабочего процесса
+_worker_timeout = None  # ограничение времени на предложение в секундах
+
+
+def _alarm(signum, frame):
+    raise SentenceTimeout()
+
+
+def _init_worker(parser_class, grammar, options, timeout):
+    # Строит парсер один раз при запуске рабочего процесса
+    _set_worker(parser_class(grammar, **options), timeout)
+
+
+def _set_worker(parser, timeout):
+    global _worker_parser, _worker_timeout
+    _worker_parser = parser
+    _worker_timeout = timeout
+    if timeout:
+        signal.signal(signal.SIGALRM, _alarm)
+
+
+def _parse_timed(sentence):
+    """
+    Разбирает предложение в рабочем процессе с ограничением времени (таймер SIGALRM прерывает разбор).
+    Таблица и лес парсера очищаются в начале следующего разбора, поэтому прерванный разбор их не портит.
+    :return: (статус 'parsed', 'failed' или 'timeout', дерево или None, время в секундах)
+    """
+    start = time.perf_counter()
+    try:
+        if _worker_timeout:
+            signal.setitimer(signal.ITIMER_REAL, _worker_timeout)
+        try:
+            can_parse, tree = _worker_parser.parse_tree(sentence)
+        finally:
+            if _worker_timeout:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        status = 'parsed' if can_parse else 'failed'
+    except SentenceTimeout:
+        status, tree = 'timeout', None
+    return status, tree, time.perf_counter() - start
+
+
+def load_grammar(path, cnf_options):
+    # Грамматика для парсера: компилированный файл .cfgc, исходная грамматика или её CNF (с кэшем .cfgc)
+    if path.endswith('.cfgc'):
+        if cnf_options is None:
+            raise ValueError("Компилированная грамматика подходит только для CKY-парсеров")
+        return cfg.CompiledGrammar.load(path)
+    if cnf_options is None:
+        return cfg.CFGrammar(path)
+    return cfg.load_compiled(path, to_cnf=True, **cnf_options)
+
+
+def configurations(args):
+    # Сочетания парсеров с параметрами отсечения: (имя, параметры to_cnf, переопределённые параметры парсера)
+    result = []
+    for name in args.parsers:
+        cnf_options, _ = PARSERS[name]
+        variants = [{}]
+        if 'pcfg' in name:  # beam и threshold действуют только в режиме Витерби
+            variants = [{'beam': beam, 'threshold': threshold}
+                        for beam in args.beams or [None] for threshold in args.thresholds or [None]]
+        for overrides in variants:
+            overrides = {key: value for key, value in overrides.items() if value is not None}
+            result.append((name, cnf_options, overrides))
+    return result
+
+
+def evaluate_parser(name, cnf_options, overrides, grammar_path, gold_trees, args):
+    # Разбор эталонных предложений одним парсером: точность по скобкам, пропускная способность, задержки
+    grammar = load_grammar(grammar_path, cnf_options)
+    parser = PARSERS[name][1](grammar)
+    if overrides:
+        if not isinstance(parser, cky_parser.CKYParser):
+            raise ValueError(f"Парсер {name} не поддерживает параметры {sorted(overrides)}")
+        parser = type(parser)(grammar, **{**parser.options, **overrides})
+    sentences = [leaves(tree) for tree in gold_trees]
+
+    start = time.perf_counter()
+    if args.workers > 1:
+        chunk_size = max(1, min(16, len(sentences) // (4 * args.workers)))
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                 initargs=(type(parser), grammar, parser.options, args.timeout)) as executor:
+            results = list(executor.map(_parse_timed, sentences, chunksize=chunk_size))
+    else:
+        _set_worker(parser, args.timeout)
+        try:
+            results = [_parse_timed(sentence) for sentence in sentences]
+        finally:
+            if args.timeout:
+                signal.signal(signal.SIGALRM, signal.SIG_DFL)
+            if hasattr(parser, 'close'):
+                parser.close()
+    wall_seconds = time.perf_counter() - start
+
+    totals = Counter()
+    by_length = {}
+    trees = []
+    for gold_tree, sentence, (status, tree, seconds) in zip(gold_trees, sentences, results):
+        gold = brackets(gold_tree, args.labels)
+        predicted = brackets(tree, args.labels)
+        matched = sum((gold & predicted).values())
+        counts = Counter({status: 1, 'matched': matched, 'gold': sum(gold.values()),
+                          'predicted': sum(predicted.values()), 'exact': status == 'parsed' and gold == predicted})
+        totals.update(counts)
+        low = (len(sentence) - 1) // args.bucket * args.bucket + 1
+        stats = by_length.setdefault(low, {'counts': Counter(), 'seconds': []})
+        stats['counts'].update(counts)
+        stats['seconds'].append(seconds)
+        trees.append(tree)
+
+    precision, recall, f1 = f1_score(totals['matched'], totals['gold'], totals['predicted'])
+    lengths = []
+    for low, stats in sorted(by_length.items()):
+        counts, seconds = stats['counts'], stats['seconds']
+        record = {'length_range': f"{low}-{low + args.bucket - 1}", 'sentences': len(seconds),
+                  'f1': f1_score(counts['matched'], counts['gold'], counts['predicted'])[2],
+                  'exact_match': counts['exact'] / len(seconds), 'timeouts': counts['timeout']}
+        for q in (50, 90, 99):
+            record[f'p{q}_ms'] = percentile(seconds, q) * 1000
+        record['max_ms'] = max(seconds) * 1000
+        lengths.append(record)
+
+    label = name + ''.join(f" {key}={value}" for key, value in sorted(overrides.items()))
+    tokens = sum(len(sentence) for sentence in sentences)
+    record = {'parser': name, 'options': overrides, 'grammar': os.path.relpath(grammar_path, BASE_DIR),
+              'sentences': len(sentences), 'parsed': totals['parsed'], 'failed': totals['failed'],
+              'timeouts': totals['timeout'], 'precision': precision, 'recall': recall, 'f1': f1,
+              'exact_match': totals['exact'] / len(sentences) if sentences else 0.0,
+              'wall_seconds': wall_seconds, 'workers': args.workers,
+              'sentences_per_second': len(sentences) / wall_seconds if wall_seconds else 0.0,
+              'tokens_per_second': tokens / wall_seconds if wall_seconds else 0.0,
+              'lengths': lengths}
+    print(f"{label:>28}: P {precision * 100:.2f} R {recall * 100:.2f} F1 {f1 * 100:.2f} "
+          f"EX {record['exact_match'] * 100:.2f}, parsed {totals['parsed']}/{len(sentences)}, "
+          f"timeouts {totals['timeout']}, {record['sentences_per_second']:.2f} sent/s, "
+          f"{record['tokens_per_second']:.1f} tok/s")
+    for length in lengths:
+        print(f"{'':>28}  n={length['length_range']:<8} F1 {length['f1'] * 100:.2f}, "
+              f"p50 {length['p50_ms']:.1f} ms, p90 {length['p90_ms']:.1f} ms, p99 {length['p99_ms']:.1f} ms")
+    return record, trees
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='PARSEVAL accuracy and throughput of the constituency parsers')
+    arg_parser.add_argument('--gold', required=True, help='held-out treebank directory or file with bracketed trees')
+    arg_parser.add_argument('--pattern', default=TREEBANK_FILES, help='treebank file names in a --gold directory')
+    arg_parser.add_argument('--lang', choices=sorted(LANGUAGES), default='eng')
+    arg_parser.add_argument('--grammar', help='source grammar or compiled .cfgc (default: the language grammar)')
+    arg_parser.add_argument('--parsers', nargs='+', choices=sorted(PARSERS), default=['cky-pcfg'])
+    arg_parser.add_argument('--beams', type=int, nargs='+', help='beam sizes to try with the pcfg parsers')
+    arg_parser.add_argument('--thresholds', type=float, nargs='+', help='pruning thresholds to try with the pcfg parsers')
+    arg_parser.add_argument('-w', '--workers', type=int, default=1, help='number of parsing processes')
+    arg_parser.add_argument('--timeout', type=float, help='seconds allowed per sentence (unparsed when exceeded)')
+    arg_parser.add_argument('--max-length', type=int, help='skip gold sentences longer than this')
+    arg_parser.add_argument('--limit', type=int, help='evaluate only the first N gold sentences')
+    arg_parser.add_argument('--labels', choices=['base', 'raw'], default='base',
+                            help='compare base categories (NP-SBJ-1 -> NP) or raw labels')
+    arg_parser.add_argument('--no-binarize', action='store_true',
+                            help='compare against the gold trees as they are, without the induction binarization')
+    arg_parser.add_argument('--bucket', type=int, default=10, help='sentence length bucket for latency percentiles')
+    arg_parser.add_argument('--output', help='write results as JSON')
+    args = arg_parser.parse_args()
+    if args.timeout and not hasattr(signal, 'setitimer'):
+        arg_parser.error('--timeout needs signal.setitimer (not available on this platform)')
+
+    grammar_path = args.grammar or LANGUAGES[args.lang]['grammar']
+    gold_trees = read_gold(args.gold, args.pattern, binarize=not args.no_binarize)
+    if args.max_length:
+        gold_trees = [tree for tree in gold_trees if len(leaves(tree)) <= args.max_length]
+    gold_trees = gold_trees[:args.limit]
+    print(f"{len(gold_trees)} gold trees from {args.gold}")
+
+    results = []
+    reference = None
+    for name, cnf_options, overrides in configurations(args):
+        record, trees = evaluate_parser(name, cnf_options, overrides, grammar_path, gold_trees, args)
+        # совпадение деревьев с первой конфигурацией: ускорение не должно менять разбор
+        if reference is None:
+            reference = trees
+        record['same_trees_as_first'] = sum(tree == first for tree, first in zip(trees, reference))
+        results.append(record)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as file:
+            json.dump({'command': 'evaluate', 'python': platform.python_version(), 'gold': args.gold,
+                       'labels': args.labels, 'timeout': args.timeout, 'results': results},
+                      file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
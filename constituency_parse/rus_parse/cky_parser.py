@@ -1,79 +1,991 @@
+import array
+import heapq
+import itertools
+import math
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from parse_forest import ParseForest
+
+
+class Chart:
+    def __init__(self):
+        """
+        Таблица CKY в виде плоского массива ячеек верхнего треугольника: отрезок [i, j), 0 <= i < j <= n,
+        лежит в cells[row_offsets[i] + j]. Пустые ячейки нижнего треугольника не создаются, а сами
+        ячейки (словари) переиспользуются следующими разборами того же парсера.
+        Доступ table[i][j] сохранён через представление строки, полная вложенная таблица - nested().
+        """
+        self.n = 0
+        self.cells = []
+        self.row_offsets = [0]
+
+    def reset(self, n):
+        # Готовит таблицу для предложения длины n, очищая ячейки прошлого разбора
+        size = n * (n + 1) // 2
+        for cell in self.cells[:size]:
+            cell.clear()
+        while len(self.cells) < size:
+            self.cells.append({})
+        self.n = n
+        # начало строки i в плоском массиве минус (i + 1), чтобы индекс ячейки был row_offsets[i] + j
+        self.row_offsets = [i * (2 * n - i + 1) // 2 - i - 1 for i in range(n + 1)]
+
+    def cell(self, i, j):
+        # Ячейка отрезка [i, j)
+        return self.cells[self.row_offsets[i] + j]
+
+    def __getitem__(self, i):
+        return _ChartRow(self, i)
+
+    def __len__(self):
+        return self.n + 1
+
+    def nested(self):
+        # Копия таблицы в виде вложенных списков (n + 1) x (n + 1), как до плоского хранения
+        n = self.n
+        return [[dict(self.cell(i, j)) if j > i else {} for j in range(n + 1)] for i in range(n + 1)]
+
+
+class _ChartRow:
+    # Строка таблицы: table[i][j] возвращает ячейку отрезка [i, j), для j <= i - пустой словарь
+    def __init__(self, chart, i):
+        self.chart = chart
+        self.i = i
+
+    def __getitem__(self, j):
+        if self.i < j <= self.chart.n:
+            return self.chart.cell(self.i, j)
+        return {}
+
+    def __len__(self):
+        return self.chart.n + 1
+
+
+class _SharedChart:
+    def __init__(self, n):
+        """
+        Таблица в общей памяти для заполнения по диагоналям в нескольких процессах.
+        Ячейка закодирована целыми числами: пары (id символа, узел леса) в порядке добавления лежат подряд
+        в общем массиве symbols, а index[2 * c] и index[2 * c + 1] - начало и число пар ячейки c
+        (нумерация Chart.cells). Пишет только родительский процесс между диагоналями;
+        когда места не хватает, массив символов переносится в новый сегмент вдвое больше.
+        """
+        size = n * (n + 1) // 2
+        self.index = shared_memory.SharedMemory(create=True, size=8 * max(size, 1))
+        self.symbols = shared_memory.SharedMemory(create=True, size=4 * max(4 * size, 16))
+        self.used = 0  # занятая часть массива symbols
+
+    def names(self):
+        return self.index.name, self.symbols.name
+
+    def write(self, c, pairs):
+        # Записывает ячейку c: плоский список id символов и узлов
+        end = self.used + len(pairs)
+        if 4 * end > self.symbols.size:
+            self._grow(4 * end)
+        with self.symbols.buf.cast('i') as symbols:
+            symbols[self.used:end] = array.array('i', pairs)
+        with self.index.buf.cast('i') as index:
+            index[2 * c] = self.used // 2
+            index[2 * c + 1] = len(pairs) // 2
+        self.used = end
+
+    def _grow(self, needed):
+        old = self.symbols
+        self.symbols = shared_memory.SharedMemory(create=True, size=max(2 * old.size, needed))
+        self.symbols.buf[:4 * self.used] = old.buf[:4 * self.used]
+        old.close()
+        old.unlink()
+
+    def close(self):
+        for segment in (self.index, self.symbols):
+            segment.close()
+            segment.unlink()
+
 
 class CKYParser:
-    def __init__(self, grammar):
-        # grammar  - Грамматика в нормальной форме Хомского (CNF)
+    ENGINES = ("sets", "numpy")
+    COARSE_THRESHOLDS = (5.0, 15.0, 45.0)  # пороги точного coarse_to_fine в режиме pcfg, по возрастанию
+
+    def __init__(self, grammar, engine="sets", pcfg=False, beam=None, threshold=None, cache=None,
+                 coarse_to_fine=False, coarse_threshold=None, wavefront_workers=1, wavefront_min_length=64,
+                 all_derivations=False):
+        # grammar  - Грамматика в нормальной форме Хомского (CNF): CFGrammar или CompiledGrammar.
+        #            Единичные правила A -> B (to_cnf(keep_unary=True)) применяются в каждой ячейке
+        #            после бинарных, см. _fill_unary и _apply_unary_viterbi
+        # engine - Способ заполнения таблицы: "sets" (множества Python) или "numpy" (булевы векторы)
+        # pcfg - Разбор Витерби по вероятностям правил: в ячейке хранится лучший вывод каждого символа
+        # beam - В режиме pcfg: сколько лучших символов оставлять в каждой ячейке
+        # threshold - В режиме pcfg: отбрасывать символы, чей log P хуже лучшего в ячейке больше чем на threshold
+        # cache - ParseCache для деревьев повторяющихся предложений и ячеек повторяющихся отрезков
+        #         (в рабочие процессы parse_many не передаётся)
+        # coarse_to_fine - Сначала разбирать грубой грамматикой (символы сведены к базовым категориям,
+        #                  см. CompiledGrammar.project) и заполнять в точной таблице только символы,
+        #                  чьи грубые символы на том же отрезке входят в полный грубый разбор
+        # coarse_threshold - Приближённое отсечение: оставлять грубые символы, у которых наибольший
+        #                    внутренний + внешний log P хуже лучшего разбора не больше чем на coarse_threshold
+        #                    (None - точный режим: дерево, а без pcfg и вся таблица полных разборов,
+        #                    совпадают с разбором без грубого прохода)
+        # wavefront_workers - Число процессов, между которыми делится заполнение таблицы одного предложения
+        #                     (см. _fill_chart_wavefront; 1 - без параллельного заполнения)
+        # wavefront_min_length - Предложения короче этого заполняются в текущем процессе:
+        #                        для них обмен с процессами дороже самого разбора
+        # all_derivations - В режиме pcfg: сохранять в лесу все выводы символов, оставшихся после отсечения,
+        #                   а не только лучший (нужно для k лучших деревьев, см. iter_parse_trees)
+        if engine not in self.ENGINES:
+            raise ValueError(f"Неизвестный движок CKY: {engine}")
+        if pcfg and engine != "sets":
+            raise ValueError("Режим pcfg поддерживается только движком sets")
+        if coarse_to_fine and engine != "sets":
+            raise ValueError("Режим coarse_to_fine поддерживается только движком sets")
+        if wavefront_workers < 1:
+            raise ValueError("Число процессов wavefront_workers должно быть положительным")
+        if wavefront_workers > 1 and (engine != "sets" or pcfg or coarse_to_fine):
+            raise ValueError("Параллельное заполнение поддерживается только движком sets без pcfg и coarse_to_fine")
         self.grammar = grammar
+        self.compiled = grammar.compile()  # индексы правил строятся один раз
+        self.engine = engine
+        self.pcfg = pcfg
+        self.beam = beam
+        self.threshold = threshold
+        self.all_derivations = all_derivations
+        # параметры, с которыми парсер пересоздаётся в рабочих процессах parse_many
+        self.options = {"engine": engine, "pcfg": pcfg, "beam": beam, "threshold": threshold,
+                        "coarse_to_fine": coarse_to_fine, "coarse_threshold": coarse_threshold,
+                        "all_derivations": all_derivations}
+        self._rule_arrays = None  # массивы правил для движка numpy, создаются при первом разборе
+        self._recognition_tables = None  # битовые маски правил для recognize, создаются при первом вызове
+        self._rule_ids = None  # бинарные правила в id символов для заполнения по диагоналям
+        # параллельное заполнение (в рабочие процессы parse_many не передаётся, как и cache)
+        self.wavefront_workers = wavefront_workers
+        self.wavefront_min_length = wavefront_min_length
+        self._wavefront_pool = None
+        # таблица, лес и булев массив numpy переиспользуются между разборами
+        self._chart = Chart()
+        self._forest = ParseForest(self.compiled.symbols)
+        self._bool_chart = None
+        self.cache = cache
+        # деревья и ячейки зависят от грамматики и всех параметров разбора из options (грубый проход с отсечением
+        # меняет результат, движок - порядок выводов); кэш с диска не должен отдавать их парсеру с другими
+        # параметрами. wavefront_workers результат не меняет и в ключ не входит
+        self._cache_key = ((self.compiled.fingerprint(), tuple(sorted(self.options.items())))
+                           if cache is not None else None)
+        self.coarse = None  # грубая грамматика для coarse_to_fine
+        self.coarse_threshold = coarse_threshold
+        if coarse_to_fine:
+            self.coarse, self._projection = self.compiled.project()
+            self._coarse_inside = Chart()
+            self._coarse_outside = Chart()
     
     def parse(self, sentence):
         """
         Реализует алгоритм CKY для синтаксического анализа предложения.
         sentence -  Список токенов (слов) предложения
+        :return: (можно ли разобрать, таблица Chart, лес разбора ParseForest). Ячейка таблицы table[i][j] -
+                 словарь с символами отрезка [i, j) в качестве ключей. Таблица и лес принадлежат парсеру
+                 и перезаписываются следующим вызовом parse.
         """
-        if not all(len(right) <= 2 for rights in self.grammar.rules.values() for right in rights):
-            raise ValueError("Грамматика должна быть в форме Хомского для CKY-разбора")
-        
+        if self.engine == "numpy" and not self.pcfg:
+            return self._parse_numpy(sentence)
+        return self._parse_chart(sentence)
+
+    def _parse_chart(self, sentence):
+        # Заполнение таблицы ячейка за ячейкой (движок sets и режим pcfg)
+        if self.coarse is not None:
+            return self._parse_coarse_to_fine(sentence)
+        return self._fill_chart(sentence)
+
+    def _parse_coarse_to_fine(self, sentence):
+        """
+        Разбор от грубого к точному. Без вероятностей точный проход ограничивается символами полных грубых
+        разборов. В режиме pcfg без coarse_threshold сначала выполняется быстрый проход с жёстким отсечением
+        (порог растёт по COARSE_THRESHOLDS, пока не найдётся разбор). Его log P - нижняя граница лучшего
+        точного разбора, а грубые оценки - верхние границы, поэтому второй проход отсекает только символы,
+        которые не могут войти в лучший разбор, и дерево Витерби совпадает с разбором без отсечения.
+        """
+        coarse_best = self._coarse_pass(sentence)
+        if coarse_best is None:  # нет даже грубого разбора - точный проход не нужен
+            table, forest = self._reset_buffers(len(sentence))
+            return False, table, forest
+        if not self.pcfg or self.coarse_threshold is not None:
+            return self._fill_chart(sentence, self._allowed_cells(len(sentence), coarse_best, self.coarse_threshold))
+
         n = len(sentence)
-        table = [[set() for _ in range(n + 1)] for _ in range(n + 1)]
-        back = [[{} for _ in range(n + 1)] for _ in range(n + 1)]
+        start_symbol = self.compiled.start_symbol
+        bound = None  # точный порог: грубая оценка минус log P найденного точного разбора
+        for threshold in self.COARSE_THRESHOLDS:
+            result = self._fill_chart(sentence, self._allowed_cells(n, coarse_best, threshold))
+            can_parse, table, _ = result
+            if can_parse:
+                lower = table[0][n][start_symbol]
+                if lower >= coarse_best - threshold:
+                    return result  # отсечённые символы хуже найденного разбора
+                bound = coarse_best - lower + 1e-9  # запас на погрешность сложения log P
+                break
+        return self._fill_chart(sentence, self._allowed_cells(n, coarse_best, bound))
+
+    def _fill_chart(self, sentence, allowed=None):
+        """
+        Заполняет таблицу снизу вверх.
+        allowed - Для coarse_to_fine: допустимые грубые символы каждой ячейки в нумерации Chart.cells
+        """
+        n = len(sentence)
+        if allowed is None and self.wavefront_workers > 1 and n >= self.wavefront_min_length:
+            return self._fill_chart_wavefront(sentence)
+        table, forest = self._reset_buffers(n)
+        cells = table.cells
+        row = table.row_offsets
         
         # Заполняем диагональ (слова)
         for i in range(n):
-            word = sentence[i]
-            for left, rights in self.grammar.rules.items():
-                for right in rights:
-                    if len(right) == 1 and right[0] == word:
-                        table[i][i+1].add(left)
+            cell = cells[row[i] + i + 1]
+            self._fill_lexical_cell(forest, cell, i, sentence[i])
+            if allowed is not None:
+                projection = self._projection
+                for symbol in [symbol for symbol in cell if projection[symbol] not in allowed[row[i] + i + 1]]:
+                    del cell[symbol]
         
         # Заполняем оставшуюся таблицу
         for length in range(2, n + 1):  # Длина отрезка
             for i in range(n - length + 1):  # Начало отрезка
                 j = i + length  # Конец отрезка
-                
-                for k in range(i + 1, j):  # Возможные разбиения
-                    for left, rights in self.grammar.rules.items():
-                        for right in rights:
-                            if len(right) == 2: 
-                                B, C = right
-                                if B in table[i][k] and C in table[k][j]:
-                                    table[i][j].add(left)
-                                    if left not in back[i][j]:
-                                        back[i][j][left] = []
-                                    back[i][j][left].append((B, C, k))
+                splits = [(k, cells[row[i] + k], cells[row[k] + j]) for k in range(i + 1, j)]  # Возможные разбиения
+                if allowed is None:
+                    self._fill_span(forest, cells[row[i] + j], i, j, splits, sentence)
+                elif allowed[row[i] + j]:
+                    # отсечённые ячейки зависят от всего предложения, поэтому кэш отрезков не используется
+                    self._fill_cell(forest, cells[row[i] + j], i, j, splits, allowed[row[i] + j])
         
-        start_symbol = next(iter(self.grammar.rules)) if self.grammar.rules else None
+        start_symbol = self.compiled.start_symbol
         can_parse = start_symbol in table[0][n]
         
-        return can_parse, table, back
+        return can_parse, table, forest
+
+    def _fill_chart_wavefront(self, sentence):
+        """
+        Заполняет таблицу по диагоналям в пуле из wavefront_workers процессов.
+        Отрезки одной длины зависят только от более коротких, поэтому пары (отрезок, точка разбиения)
+        очередной диагонали делятся между процессами поровну. Процессы читают готовые ячейки из общей
+        памяти (_SharedChart) в порядке добавления символов, перебирают выводы в том же порядке, что и
+        _fill_cell_sets, и возвращают готовые массивы рёбер; текущий процесс только создаёт узлы и
+        дописывает рёбра в лес пачками (ParseForest.append_edges). Таблица, лес и деревья совпадают
+        с последовательным заполнением. Кэш отрезков при этом не используется.
+        """
+        n = len(sentence)
+        table, forest = self._reset_buffers(n)
+        cells = table.cells
+        row = table.row_offsets
+        symbols = self.compiled.symbols
+        symbol_ids = self.compiled.symbol_ids
+        workers = self.wavefront_workers
+        if self._wavefront_pool is None:
+            self._wavefront_pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                       initargs=(type(self), self.grammar, self.options))
+
+        shared = _SharedChart(n)
+        try:
+            for i in range(n):
+                cell = cells[row[i] + i + 1]
+                self._fill_lexical_cell(forest, cell, i, sentence[i])
+                shared.write(row[i] + i + 1, [x for symbol, node in cell.items() for x in (symbol_ids[symbol], node)])
+
+            for length in range(2, n + 1):
+                spans = n - length + 1
+                pairs = spans * (length - 1)
+                bounds = [pairs * worker // workers for worker in range(workers + 1)]
+                tasks = [(shared.names(), n, length, start, stop)
+                         for start, stop in zip(bounds, bounds[1:]) if start < stop]
+                found = [[] for _ in range(spans)]  # рёбра отрезков диагонали, частями по возрастанию k
+                for part in self._wavefront_pool.map(_fill_diagonal, tasks):
+                    for i, edges in part:
+                        found[i].append(edges)
+
+                for i in range(spans):
+                    j = i + length
+                    cell = cells[row[i] + j]
+                    for heads, *edges in found[i]:
+                        forest.append_edges(i, j, cell, [symbols[head] for head in heads], *edges)
+                    self._fill_unary(forest, cell, i, j)
+                    if length < n:
+                        shared.write(row[i] + j, [x for symbol, node in cell.items() for x in (symbol_ids[symbol], node)])
+        finally:
+            shared.close()
+
+        return self.compiled.start_symbol in table[0][n], table, forest
+
+    def _binary_rule_ids(self):
+        # Бинарные правила в id символов: список по B из None или {C: (A, ...)}
+        if self._rule_ids is None:
+            ids = self.compiled.symbol_ids
+            self._rule_ids = [None] * len(self.compiled.symbols)
+            for B, by_right in self.compiled.binary.items():
+                self._rule_ids[ids[B]] = {ids[C]: tuple(ids[left] for left in lefts)
+                                          for C, lefts in by_right.items()}
+        return self._rule_ids
+
+    def close(self):
+        # Останавливает процессы параллельного заполнения таблицы
+        if self._wavefront_pool is not None:
+            self._wavefront_pool.shutdown()
+            self._wavefront_pool = None
+
+    def _fill_lexical_cell(self, forest, cell, i, word):
+        # Заполняет ячейку слова [i, i + 1)
+        if self.pcfg:
+            cell_back = {}
+            for left, score in self.compiled.lexicon_scores.get(word, ()):
+                if score > cell.get(left, -math.inf):
+                    cell[left] = score
+                    cell_back[left] = (None, None, None, score)
+            self._finish_viterbi_cell(forest, cell, cell_back, i, i + 1)
+        else:
+            self._add_lexical(forest, cell, i, word)
+            self._fill_unary(forest, cell, i, i + 1)
+
+    def _fill_span(self, forest, cell, i, j, splits, sentence):
+        # Заполняет ячейку [i, j) из кэша отрезков или вычисляет и кэширует её
+        cache = self.cache
+        if cache is None or j - i < cache.min_span:
+            self._fill_cell(forest, cell, i, j, splits)
+            return
+        key = (self._cache_key, tuple(sentence[i:j]))
+        fragment = cache.lookup("span", key)
+        if fragment is not None:
+            for symbol, node, score in forest.import_cell(i, j, fragment):
+                cell[symbol] = score if self.pcfg else node
+            return
+        nodes, edges = forest.size()
+        self._fill_cell(forest, cell, i, j, splits)
+        cache.store("span", key, forest.export_cell(i, j, nodes, edges))
+
+    def _fill_cell(self, forest, cell, i, j, splits, allowed=None):
+        """
+        Заполняет ячейку отрезка [i, j) по уже заполненным более коротким отрезкам.
+        splits - Список (k, ячейка [i, k), ячейка [k, j)) для всех точек разбиения
+        allowed - Грубые символы, разрешённые на отрезке (coarse_to_fine), None - без ограничений
+        """
+        if self.pcfg:
+            self._fill_cell_viterbi(forest, cell, i, j, splits, allowed)
+        else:
+            self._fill_cell_sets(forest, cell, i, j, splits, allowed)
+
+    def _coarse_pass(self, sentence):
+        """
+        Грубый проход coarse_to_fine: наибольшие внутренние и внешние log P по грубой грамматике
+        (таблицы _coarse_inside и _coarse_outside). Внешняя оценка есть только у символов полных разборов.
+        :return: log P лучшего грубого разбора или None, если предложение не разбирается даже грубой грамматикой
+        """
+        coarse = self.coarse
+        n = len(sentence)
+        inside = self._coarse_inside
+        outside = self._coarse_outside
+        inside.reset(n)
+        outside.reset(n)
+        cells = inside.cells
+        out_cells = outside.cells
+        row = inside.row_offsets
+        binary = coarse.binary_scores
+        closure = coarse.unary_closure
+
+        for i, word in enumerate(sentence):
+            cell = cells[row[i] + i + 1]
+            for left, score in coarse.lexicon_scores.get(word, ()):
+                if left not in cell or score > cell[left]:
+                    cell[left] = score
+            if closure:
+                self._coarse_unary_inside(cell, closure)
+        for length in range(2, n + 1):
+            for i in range(n - length + 1):
+                j = i + length
+                cell = cells[row[i] + j]
+                for k in range(i + 1, j):
+                    left_cell = cells[row[i] + k]
+                    right_cell = cells[row[k] + j]
+                    if not left_cell or not right_cell:
+                        continue
+                    for B, left_score in left_cell.items():
+                        by_right = binary.get(B)
+                        if not by_right:
+                            continue
+                        for C, right_score in right_cell.items():
+                            for A, rule_score in by_right.get(C, ()):
+                                score = left_score + right_score + rule_score
+                                if A not in cell or score > cell[A]:
+                                    cell[A] = score
+                if closure and cell:
+                    self._coarse_unary_inside(cell, closure)
+
+        start_symbol = coarse.start_symbol
+        if not n or start_symbol not in cells[row[0] + n]:
+            return None
+
+        # Внешние оценки сверху вниз; символ получает оценку, только если входит в полный разбор
+        out_cells[row[0] + n][start_symbol] = 0.0
+        for length in range(n, 1, -1):
+            for i in range(n - length + 1):
+                j = i + length
+                out_cell = out_cells[row[i] + j]
+                if not out_cell:
+                    continue
+                if closure:
+                    self._coarse_unary_outside(cells[row[i] + j], out_cell, closure)
+                for k in range(i + 1, j):
+                    left_cell = cells[row[i] + k]
+                    right_cell = cells[row[k] + j]
+                    if not left_cell or not right_cell:
+                        continue
+                    left_out = out_cells[row[i] + k]
+                    right_out = out_cells[row[k] + j]
+                    for B, left_score in left_cell.items():
+                        by_right = binary.get(B)
+                        if not by_right:
+                            continue
+                        for C, right_score in right_cell.items():
+                            for A, rule_score in by_right.get(C, ()):
+                                if A not in out_cell:
+                                    continue
+                                score = out_cell[A] + rule_score
+                                if B not in left_out or score + right_score > left_out[B]:
+                                    left_out[B] = score + right_score
+                                if C not in right_out or score + left_score > right_out[C]:
+                                    right_out[C] = score + left_score
+        if closure:
+            for i in range(n):
+                if out_cells[row[i] + i + 1]:
+                    self._coarse_unary_outside(cells[row[i] + i + 1], out_cells[row[i] + i + 1], closure)
+
+        return cells[row[0] + n][start_symbol]
+
+    @staticmethod
+    def _coarse_unary_inside(cell, closure):
+        # Внутренние оценки после единичных правил: лучшие цепочки A -> ... -> B от символов ячейки
+        for B, base_score in list(cell.items()):
+            for A, _, chain_score, _ in closure.get(B, ()):
+                score = base_score + chain_score
+                if A not in cell or score > cell[A]:
+                    cell[A] = score
+
+    @staticmethod
+    def _coarse_unary_outside(cell, out_cell, closure):
+        # Внешние оценки через единичные правила: B получает оценку A плюс лучшую цепочку A -> ... -> B.
+        # Промежуточный символ P цепочки тоже есть в ячейке, а A - в замыкании P, поэтому оценку получает и он
+        base = dict(out_cell)
+        for B in cell:
+            for A, _, chain_score, _ in closure.get(B, ()):
+                if A in base:
+                    score = base[A] + chain_score
+                    if B not in out_cell or score > out_cell[B]:
+                        out_cell[B] = score
+
+    def _allowed_cells(self, n, coarse_best, threshold):
+        # Допустимые грубые символы ячеек: все символы полных грубых разборов (threshold=None)
+        # или только те, чей лучший полный разбор хуже лучшего не больше чем на threshold
+        size = n * (n + 1) // 2
+        out_cells = self._coarse_outside.cells[:size]
+        if threshold is None:
+            return out_cells
+        bound = coarse_best - threshold
+        return [{symbol for symbol, score in out_cell.items() if cell[symbol] + score >= bound}
+                for cell, out_cell in zip(self._coarse_inside.cells, out_cells)]
+
+    def _fill_cell_sets(self, forest, cell, i, j, splits, allowed=None):
+        # Ячейка - словарь {символ: узел леса}; порядок вставки фиксирует порядок перебора,
+        # а значит и первый вывод, независимо от хэшей строк. Сохраняются все выводы.
+        binary = self.compiled.binary
+        projection = self._projection if self.coarse is not None else None
+        for k, left_cell, right_cell in splits:
+            if not right_cell:
+                continue
+            # Перебираем только пары символов, реально присутствующие в подотрезках
+            for B, left_node in left_cell.items():
+                by_right = binary.get(B)
+                if not by_right:
+                    continue
+                for C, right_node in right_cell.items():
+                    lefts = by_right.get(C)
+                    if not lefts:
+                        continue
+                    for left in lefts:
+                        if allowed is not None and projection[left] not in allowed:
+                            continue
+                        node = cell.get(left)
+                        if node is None:
+                            node = cell[left] = forest.add_node(i, j, left)
+                        forest.add_edge(node, left_node, right_node)
+        self._fill_unary(forest, cell, i, j, allowed)
+
+    def _fill_unary(self, forest, cell, i, j, allowed=None):
+        """
+        Единичные правила A -> B в ячейке {символ: узел}: символы обходятся в порядке добавления (новые
+        символы дописываются в конец), поэтому каждое правило срабатывает в ячейке не больше одного раза.
+        Вывод A -> B, замыкающий цикл единичных правил внутри ячейки, не добавляется: лес остаётся
+        ациклическим, а число деревьев - конечным.
+        """
+        unary = self.compiled.unary
+        if not unary or not cell:
+            return
+        projection = self._projection if allowed is not None else None
+        below = {}  # узел -> узлы ячейки, на которые ссылаются его единичные выводы
+        order = list(cell)
+        for B in order:  # список растёт по ходу обхода
+            parents = unary.get(B)
+            if not parents:
+                continue
+            child = cell[B]
+            for left in parents:
+                if allowed is not None and projection[left] not in allowed:
+                    continue
+                node = cell.get(left)
+                if node is None:
+                    node = cell[left] = forest.add_node(i, j, left)
+                    order.append(left)
+                elif self._unary_reaches(below, child, node):
+                    continue
+                forest.add_edge(node, child)
+                below.setdefault(node, []).append(child)
+
+    @staticmethod
+    def _unary_reaches(below, start, target):
+        # Достижим ли target из start по единичным выводам ячейки
+        stack = [start]
+        seen = {start}
+        while stack:
+            node = stack.pop()
+            if node == target:
+                return True
+            for child in below.get(node, ()):
+                if child not in seen:
+                    seen.add(child)
+                    stack.append(child)
+        return False
+
+    def _reset_buffers(self, n):
+        # Очищает переиспользуемые таблицу и лес для предложения длины n
+        self._chart.reset(n)
+        self._forest.reset(n)
+        return self._chart, self._forest
+
+    def _add_lexical(self, forest, cell, i, word, scored=False):
+        # Заполняет ячейку слова: узел и лексический вывод для каждого правила A -> word
+        for left, score in self.compiled.lexicon_scores.get(word, ()):
+            if not scored:
+                score = 0.0
+            node = forest.add_node(i, i + 1, left, score)
+            forest.add_edge(node, score=score)
+            cell[left] = score if scored else node
+
+    def recognize(self, sentence):
+        """
+        Только проверяет, выводится ли предложение, без леса разбора и указателей.
+        Ячейка таблицы - битовая маска символов (целое число Python). Таблица заполняется по столбцам слева
+        направо: в ячейку [i, j) попадают только символы, которые могут начинаться в позиции i при уже
+        разобранном префиксе (как предсказание в алгоритме Эрли), и проверка заканчивается, как только
+        префикс перестаёт быть началом какого-либо предложения. Слова без лексических правил отсекаются
+        до заполнения таблицы. Отсечение pcfg (beam, threshold) и грубый проход не применяются.
+        sentence - Список токенов (слов) предложения
+        :return: True, если предложение разбирается
+        """
+        n = len(sentence)
+        if not n or self.compiled.start_symbol is None:
+            return False
+        if self._recognition_tables is None:
+            self._recognition_tables = self._build_recognition_tables()
+        lexicon, binary, unary, predictions, corners, start_bit = self._recognition_tables
+
+        word_masks = []
+        for word in sentence:
+            mask = lexicon.get(word)
+            if mask is None:
+                return False
+            word_masks.append(mask)
+
+        columns = [[]]  # columns[j][i] - маска ячейки [i, j)
+        opened = [corners[start_bit.bit_length() - 1]]  # opened[i] - символы, которые могут начинаться в i
+        for j in range(1, n + 1):
+            column = [0] * j
+            columns.append(column)
+            column[j - 1] = word_masks[j - 1] & opened[j - 1]
+            if not column[j - 1]:
+                return False  # ни одно предложение не начинается с этого префикса
+            for i in range(j - 2, -1, -1):
+                mask = 0
+                for k in range(i + 1, j):
+                    right = column[k]
+                    if not right:
+                        continue
+                    left = columns[k][i]
+                    while left:
+                        low = left & -left
+                        left ^= low
+                        entry = binary[low.bit_length() - 1]
+                        if entry is None:
+                            continue
+                        partners, lhs_masks = entry
+                        common = right & partners
+                        while common:
+                            low = common & -common
+                            common ^= low
+                            mask |= lhs_masks[low.bit_length() - 1]
+                if unary and mask:
+                    mask = self._close_mask(mask, unary)
+                column[i] = mask & opened[i]
+
+            if j < n:
+                # символы, которые могут начинаться в j: правые потомки C правил A -> B C, где A может
+                # начинаться в i, а B покрывает [i, j), вместе с их левыми углами
+                predicted = 0
+                for i in range(j):
+                    cell = column[i]
+                    allowed = opened[i]
+                    while cell:
+                        low = cell & -cell
+                        cell ^= low
+                        for right_bit, lefts in predictions[low.bit_length() - 1]:
+                            if lefts & allowed:
+                                predicted |= right_bit
+                closure = 0
+                while predicted:
+                    low = predicted & -predicted
+                    predicted ^= low
+                    closure |= corners[low.bit_length() - 1]
+                opened.append(closure)
+
+        return bool(columns[n][0] & start_bit)
+
+    def _build_recognition_tables(self):
+        """
+        Маски правил для recognize (бит символа - его id в CompiledGrammar.symbols):
+        слово -> маска A для правил A -> слово (вместе с единичными цепочками над A);
+        binary[B] = (маска C, {C: маска A}) для правил A -> B C; unary - {id B: маска всех A, из которых
+        B выводится цепочкой единичных правил}; predictions[B] = [(бит C, маска A), ...];
+        corners[X] - маска левых углов X (CompiledGrammar.left_corners).
+        """
+        compiled = self.compiled
+        ids = compiled.symbol_ids
+        unary = {}
+        for B in compiled.unary:
+            mask = 0
+            stack = [B]
+            seen = {B}
+            while stack:
+                for left in compiled.unary.get(stack.pop(), ()):
+                    if left not in seen:
+                        seen.add(left)
+                        stack.append(left)
+                        mask |= 1 << ids[left]
+            unary[ids[B]] = mask
+        lexicon = {}
+        for word, lefts in compiled.lexicon.items():
+            for left in lefts:
+                lexicon[word] = lexicon.get(word, 0) | 1 << ids[left]
+        if unary:
+            lexicon = {word: self._close_mask(mask, unary) for word, mask in lexicon.items()}
+        binary = [None] * len(compiled.symbols)
+        predictions = [[] for _ in compiled.symbols]
+        for B, by_right in compiled.binary.items():
+            partners = 0
+            lhs_masks = {}
+            for C, lefts in by_right.items():
+                lefts_mask = 0
+                for left in lefts:
+                    lefts_mask |= 1 << ids[left]
+                partners |= 1 << ids[C]
+                lhs_masks[ids[C]] = lefts_mask
+                predictions[ids[B]].append((1 << ids[C], lefts_mask))
+            binary[ids[B]] = (partners, lhs_masks)
+        corners = []
+        for symbol in compiled.symbols:
+            mask = 0
+            for corner in compiled.left_corners(symbol):
+                mask |= 1 << ids[corner]
+            corners.append(mask)
+        return lexicon, binary, unary, predictions, corners, 1 << ids[compiled.start_symbol]
+
+    @staticmethod
+    def _close_mask(mask, unary):
+        # Добавляет к маске символов всех A, из которых они выводятся единичными правилами
+        closed = mask
+        while mask:
+            low = mask & -mask
+            mask ^= low
+            closed |= unary.get(low.bit_length() - 1, 0)
+        return closed
+
+    def incremental(self):
+        # Пошаговый разбор: токены добавляются по одному, см. IncrementalParse
+        return IncrementalParse(self)
+
+    def parse_tree(self, sentence):
+        """
+        Разбирает предложение и сразу восстанавливает дерево.
+        :return: (можно ли разобрать, дерево разбора или None)
+        """
+        if self.cache is not None:
+            key = (self._cache_key, tuple(sentence))
+            result = self.cache.lookup("sentence", key)
+            if result is None:
+                can_parse, table, back = self.parse(sentence)
+                result = (can_parse, self.extract_parse_tree(sentence, table, back))
+                self.cache.store("sentence", key, result)
+            return result
+        can_parse, table, back = self.parse(sentence)
+        return can_parse, self.extract_parse_tree(sentence, table, back)
+
+    def parse_many(self, sentences, workers=1, chunk_size=16):
+        """
+        Разбирает поток предложений в пуле процессов.
+        Каждый процесс один раз строит свой парсер с компилированной грамматикой, предложения
+        отправляются пачками по chunk_size, а результаты возвращаются в порядке входа по мере готовности.
+        В работе одновременно не больше 2 * workers пачек, поэтому память не растёт с размером входа.
+        sentences - Итерируемый набор предложений (списков токенов)
+        workers - Число рабочих процессов (1 - разбор в текущем процессе)
+        :return: Генератор пар (можно ли разобрать, дерево разбора или None)
+        """
+        if workers <= 1:
+            for sentence in sentences:
+                yield self.parse_tree(sentence)
+            return
+
+        sentences = iter(sentences)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(type(self), self.grammar, self.options)) as executor:
+            pending = deque()
+            while True:
+                while len(pending) < 2 * workers:
+                    chunk = list(itertools.islice(sentences, chunk_size))
+                    if not chunk:
+                        break
+                    pending.append(executor.submit(_parse_chunk, chunk))
+                if not pending:
+                    break
+                yield from pending.popleft().result()
+
+    def _fill_cell_viterbi(self, forest, cell, i, j, splits, allowed=None):
+        """
+        Вероятностный CKY (алгоритм Витерби). Ячейка таблицы - словарь {символ: лучший log P},
+        у каждого узла леса первый вывод - лучший; остальные выводы сохраняются только с all_derivations.
+        """
+        binary = self.compiled.binary_scores
+        projection = self._projection if self.coarse is not None else None
+        cell_back = {}  # символ -> (B, C, k, log P правила) лучшего вывода
+        derivations = [] if self.all_derivations else None  # все бинарные выводы: (A, B, C, k, log P правила)
+
+        for k, left_cell, right_cell in splits:
+            if not right_cell:
+                continue
+            for B, left_score in left_cell.items():
+                by_right = binary.get(B)
+                if not by_right:
+                    continue
+                for C, right_score in right_cell.items():
+                    scored = by_right.get(C)
+                    if not scored:
+                        continue
+                    for left, rule_score in scored:
+                        if allowed is not None and projection[left] not in allowed:
+                            continue
+                        score = left_score + right_score + rule_score
+                        if derivations is not None:
+                            derivations.append((left, B, C, k, rule_score))
+                        if score > cell.get(left, -math.inf):
+                            cell[left] = score
+                            cell_back[left] = (B, C, k, rule_score)
+
+        self._finish_viterbi_cell(forest, cell, cell_back, i, j, allowed, derivations)
+
+    def _finish_viterbi_cell(self, forest, cell, cell_back, i, j, allowed=None, derivations=None):
+        """
+        Единичные правила, отсечение и узлы леса для ячейки Витерби.
+        cell_back - символ -> лучший вывод: (B, C, k, log P правила) для A -> B C,
+                    (P, None, None, log P) для единичного A -> P, (None, None, None, log P) для слова
+        derivations - Для all_derivations: все бинарные выводы ячейки (A, B, C, k, log P правила)
+        """
+        if self.compiled.unary_closure and cell:
+            self._apply_unary_viterbi(cell, cell_back, allowed)
+        self._prune_cell(cell, cell_back)
+        nodes = {left: forest.add_node(i, j, left, score) for left, score in cell.items()}
+        for left, node in nodes.items():
+            B, C, k, rule_score = cell_back[left]
+            if B is None:
+                forest.add_edge(node, score=rule_score)
+            elif C is None:
+                forest.add_edge(node, nodes[B], score=rule_score)
+            else:
+                forest.add_edge(node, forest.node(i, k, B), forest.node(k, j, C), rule_score)
+        if self.all_derivations:
+            self._add_other_derivations(forest, cell_back, nodes, i, j, derivations or ())
+
+    def _add_other_derivations(self, forest, cell_back, nodes, i, j, derivations):
+        """
+        Добавляет узлам ячейки Витерби остальные выводы после лучшего. Оценка узла остаётся лучшим
+        внутренним log P, поэтому iter_parse_trees перебирает деревья от лучшего к худшему.
+        Единичный вывод A -> P, замыкающий цикл единичных правил в ячейке, не добавляется, как в _fill_unary.
+        """
+        for left, B, C, k, rule_score in derivations:
+            node = nodes.get(left)
+            if node is not None and cell_back[left][:3] != (B, C, k):
+                forest.add_edge(node, forest.node(i, k, B), forest.node(k, j, C), rule_score)
+        unary_scores = self.compiled.unary_scores
+        if not unary_scores:
+            return
+        below = {}  # узел -> узлы ячейки, на которые ссылаются его единичные выводы
+        for left, (P, C, _, _) in cell_back.items():
+            if P is not None and C is None:
+                below.setdefault(nodes[left], []).append(nodes[P])
+        for P, child in nodes.items():
+            for left, rule_score in unary_scores.get(P, ()):
+                node = nodes.get(left)
+                if node is None or cell_back[left][:2] == (P, None) or self._unary_reaches(below, child, node):
+                    continue
+                forest.add_edge(node, child, score=rule_score)
+                below.setdefault(node, []).append(child)
+
+    def _apply_unary_viterbi(self, cell, cell_back, allowed=None):
+        # Замыкание единичных правил за один проход: для каждого символа B, полученного бинарным или
+        # лексическим правилом, сразу берутся лучшие цепочки A -> ... -> B (CompiledGrammar.unary_closure)
+        closure = self.compiled.unary_closure
+        for B, base_score in list(cell.items()):
+            for left, P, chain_score, rule_score in closure.get(B, ()):
+                score = base_score + chain_score
+                if score > cell.get(left, -math.inf):
+                    cell[left] = score
+                    cell_back[left] = (P, None, None, rule_score)
+        if allowed is not None:
+            projection = self._projection
+            self._keep_symbols(cell, cell_back, [symbol for symbol in cell if projection[symbol] in allowed])
+
+    def _prune_cell(self, cell, cell_back):
+        # Оставляет в ячейке не более beam лучших символов и символы не хуже порога
+        if not cell or (self.beam is None and self.threshold is None):
+            return
+        keep = cell.keys()
+        if self.beam is not None and len(cell) > self.beam:
+            keep = heapq.nlargest(self.beam, cell, key=cell.get)
+        if self.threshold is not None:
+            best = max(cell.values())
+            keep = [symbol for symbol in keep if cell[symbol] >= best - self.threshold]
+        self._keep_symbols(cell, cell_back, keep)
+
+    @staticmethod
+    def _keep_symbols(cell, cell_back, keep):
+        # Удаляет из ячейки символы не из keep; промежуточные символы единичных цепочек оставленных
+        # символов сохраняются, чтобы их выводы ссылались на узлы той же ячейки
+        keep = set(keep)
+        for symbol in list(keep):
+            back = cell_back.get(symbol)
+            while back is not None and back[0] is not None and back[1] is None and back[0] not in keep:
+                keep.add(back[0])
+                back = cell_back.get(back[0])
+        for symbol in [symbol for symbol in cell if symbol not in keep]:
+            del cell[symbol]
+            cell_back.pop(symbol, None)
+
+    def _parse_numpy(self, sentence):
+        """
+        Векторизованное заполнение таблицы: каждая ячейка - булева строка по id нетерминалов,
+        бинарные правила применяются сразу ко всем точкам разбиения отрезка.
+        """
+        import numpy as np
+
+        compiled = self.compiled
+        if self._rule_arrays is None:
+            self._rule_arrays = tuple(np.frombuffer(rules, dtype=np.int32) for rules in
+                                      (compiled.binary_lhs, compiled.binary_left, compiled.binary_right))
+        rule_lhs, rule_b, rule_c = self._rule_arrays
+        symbols = compiled.symbols
+
+        n = len(sentence)
+        if self._bool_chart is None or self._bool_chart.shape[0] < n + 1:
+            self._bool_chart = np.zeros((n + 1, n + 1, len(symbols)), dtype=bool)
+        chart = self._bool_chart[:n + 1, :n + 1]
+        chart[...] = False
+        table, forest = self._reset_buffers(n)
+        cells = table.cells
+        row = table.row_offsets
+
+        # Заполняем диагональ (слова)
+        for i in range(n):
+            self._add_lexical(forest, cells[row[i] + i + 1], i, sentence[i])
+            self._fill_unary(forest, cells[row[i] + i + 1], i, i + 1)
+            for left in cells[row[i] + i + 1]:
+                chart[i, i + 1, compiled.symbol_ids[left]] = True
+
+        # Заполняем оставшуюся таблицу
+        for length in range(2, n + 1):
+            for i in range(n - length + 1):
+                j = i + length
+                left_cells = chart[i, i + 1:j]  # (k, символ) для отрезков [i, k)
+                right_cells = chart[i + 1:j, j]  # (k, символ) для отрезков [k, j)
+
+                # Отбираем правила, у которых B и C встречаются хотя бы в одной точке разбиения
+                candidates = np.flatnonzero(left_cells.any(axis=0)[rule_b] & right_cells.any(axis=0)[rule_c])
+                if candidates.size == 0:
+                    continue
+                fired = left_cells[:, rule_b[candidates]] & right_cells[:, rule_c[candidates]]
+                splits, rule_idx = np.nonzero(fired)
+                if splits.size == 0:
+                    continue
+
+                rule_idx = candidates[rule_idx]
+                chart[i, j, rule_lhs[rule_idx]] = True
+                cell = cells[row[i] + j]
+                for split, r in zip(splits.tolist(), rule_idx.tolist()):
+                    k = i + 1 + split
+                    left = symbols[rule_lhs[r]]
+                    node = cell.get(left)
+                    if node is None:
+                        node = cell[left] = forest.add_node(i, j, left)
+                    forest.add_edge(node, cells[row[i] + k][symbols[rule_b[r]]], cells[row[k] + j][symbols[rule_c[r]]])
+                if compiled.unary:
+                    self._fill_unary(forest, cell, i, j)
+                    chart[i, j, [compiled.symbol_ids[left] for left in cell]] = True
+
+        can_parse = compiled.start_symbol in table[0][n]
+
+        return can_parse, table, forest
     
     def extract_parse_tree(self, sentence, parse_table, backpointers):
         """
         Восстанавливает дерево разбора из CKY-таблицы.
         sentence: Входное предложение (список токенов)
         parse_table: Заполненная CKY-таблица
-        backpointers: Указатели для восстановления дерева
+        backpointers: Лес разбора (ParseForest)
         :return: Вложенный кортеж, представляющий дерево разбора, или None
         """
         n = len(sentence)
-        start_symbol = next(iter(self.grammar.rules)) if self.grammar.rules else None
+        start_symbol = self.compiled.start_symbol
         
         if not start_symbol or start_symbol not in parse_table[0][n]:
             return None
         
-        def build_tree(symbol, i, j):
-            if j - i == 1:
-                return (symbol, sentence[i])
-            
-            if symbol not in backpointers[i][j]:
-                return None
-            
-            B, C, k = backpointers[i][j][symbol][0]
-            left_tree = build_tree(B, i, k)
-            right_tree = build_tree(C, k, j)
-            
-            return (symbol, left_tree, right_tree)
-        
-        return build_tree(start_symbol, 0, n)
+        return backpointers.build_tree(backpointers.node(0, n, start_symbol), sentence)
+
+    def iter_parse_trees(self, sentence, parse_table, backpointers, k=None):
+        """
+        Лениво перечисляет деревья разбора. Для PCFG - от лучшего к худшему, если парсер создан
+        с all_derivations (иначе в лесу только выводы Витерби и дерево одно); без PCFG - в порядке обнаружения.
+        k: Максимальное число деревьев (None - все)
+        :return: Генератор вложенных кортежей
+        """
+        n = len(sentence)
+        start_symbol = self.compiled.start_symbol
+        if not start_symbol or start_symbol not in parse_table[0][n]:
+            return iter(())
+        return backpointers.iter_trees(backpointers.node(0, n, start_symbol), sentence, k)
     
+    def format_parse_tree(self, tree):
+        """
+        Записывает дерево разбора в одну строку в скобочной нотации: (S (NP ...) (VP ...)).
+        tree: Вложенный кортеж, представляющий дерево разбора
+        """
+        if tree is None:
+            return "None"
+        if isinstance(tree, tuple):
+            return "(" + " ".join([str(tree[0])] + [self.format_parse_tree(subtree) for subtree in tree[1:]]) + ")"
+        return str(tree)
+
     def print_parse_tree(self, tree, indent=0):
         """
         Выводит в консоль дерево разбора.
@@ -92,4 +1004,196 @@ class CKYParser:
                 for subtree in tree[1:]:
                     self.print_parse_tree(subtree, indent + 2)
         else:
-            print(" " * indent + str(tree))
\ No newline at end of file
+            print(" " * indent + str(tree))
+
+
+class IncrementalParse:
+    def __init__(self, parser):
+        """
+        Пошаговый CKY слева направо: таблица заполняется по столбцам. Добавление токена вычисляет
+        только ячейки [i, j), заканчивающиеся на нём, и проверяет, остаётся ли префикс началом
+        хотя бы одного предложения грамматики. Для проверки поддерживаются множества символов,
+        которые могут начинаться в каждой позиции (как предсказание в алгоритме Эрли).
+        parser - CKYParser, задающий грамматику и режим заполнения ячеек
+        """
+        self.parser = parser
+        self.compiled = parser.compiled
+        self.tokens = []
+        self.columns = [[]]  # columns[j][i] - ячейка отрезка [i, j)
+        self.forest = ParseForest(self.compiled.symbols)
+        self._sizes = []  # размер леса перед каждым токеном (для отката)
+        start_symbol = self.compiled.start_symbol
+        # _predicted[j] - символы, вывод которых может начинаться в позиции j при разобранном префиксе
+        self._predicted = [self.compiled.left_corners(start_symbol) if start_symbol else frozenset()]
+        self._viable = [start_symbol is not None]
+
+    @property
+    def n(self):
+        return len(self.tokens)
+
+    def cell(self, i, j):
+        # Ячейка отрезка [i, j)
+        return self.columns[j][i]
+
+    def __getitem__(self, i):
+        return _ChartRow(self, i)
+
+    def push(self, token):
+        """
+        Добавляет токен в конец и заполняет новый столбец таблицы.
+        :return: Остаётся ли префикс допустимым началом предложения
+        """
+        parser = self.parser
+        j = len(self.tokens) + 1
+        self._sizes.append(self.forest.size())
+        self.tokens.append(token)
+        column = [{} for _ in range(j)]
+        self.columns.append(column)
+
+        parser._fill_lexical_cell(self.forest, column[j - 1], j - 1, token)
+        for i in range(j - 2, -1, -1):
+            splits = [(k, self.columns[k][i], column[k]) for k in range(i + 1, j)]
+            parser._fill_span(self.forest, column[i], i, j, splits, self.tokens)
+
+        opened = self._predicted[-1]
+        viable = self._viable[-1] and any(symbol in opened for symbol in column[j - 1])
+        self._viable.append(viable)
+        self._predicted.append(self._predict(j) if viable else frozenset())
+        return viable
+
+    def pop(self):
+        # Убирает последний токен и его столбец (например, при редактировании ввода)
+        if not self.tokens:
+            raise IndexError("Нет токенов для удаления")
+        self.tokens.pop()
+        self.columns.pop()
+        self._viable.pop()
+        self._predicted.pop()
+        self.forest.truncate(*self._sizes.pop())
+        return self.is_viable()
+
+    def is_viable(self):
+        # Может ли текущий префикс быть продолжен до предложения грамматики
+        return self._viable[-1]
+
+    def can_parse(self):
+        # Разбирается ли текущий префикс как полное предложение
+        return bool(self.tokens) and self.compiled.start_symbol in self.columns[-1][0]
+
+    def result(self):
+        # Результат в формате CKYParser.parse: (можно ли разобрать, таблица, лес разбора)
+        return self.can_parse(), self, self.forest
+
+    def _predict(self, j):
+        # Символы, которые могут начинаться в позиции j: C из правил A -> B C, где A может
+        # начинаться в i, а B покрывает [i, j), вместе с их левыми углами
+        binary = self.compiled.binary
+        predicted = set()
+        for i in range(j):
+            opened = self._predicted[i]
+            if not opened:
+                continue
+            for B in self.columns[j][i]:
+                for C, lefts in binary.get(B, {}).items():
+                    if C not in predicted and any(left in opened for left in lefts):
+                        predicted.add(C)
+        corners = set()
+        for symbol in predicted:
+            corners |= self.compiled.left_corners(symbol)
+        return frozenset(corners)
+
+
+_worker_parser = None  # парсер рабочего процесса parse_many
+
+
+def _init_worker(parser_class, grammar, options):
+    # Строит парсер один раз при запуске рабочего процесса
+    global _worker_parser
+    _worker_parser = parser_class(grammar, **options)
+
+
+def _parse_chunk(sentences):
+    return [_worker_parser.parse_tree(sentence) for sentence in sentences]
+
+
+_worker_chart = None  # [имена сегментов, сегменты, их представления int32, прочитанные ячейки]
+
+
+def _attach_chart(names):
+    # Подключает рабочий процесс к общей таблице; прочитанные ячейки сбрасываются с новым предложением
+    global _worker_chart
+    if _worker_chart is not None and _worker_chart[0] == names:
+        return _worker_chart
+    cells = {}
+    if _worker_chart is not None:
+        old_names, segments, views, old_cells = _worker_chart
+        if old_names[0] == names[0]:
+            cells = old_cells  # тот же разбор, перенесён только массив символов
+        for view in views:
+            view.release()
+        for segment in segments:
+            segment.close()
+    segments = [shared_memory.SharedMemory(name=name) for name in names]
+    _worker_chart = [names, segments, [segment.buf.cast('i') for segment in segments], cells]
+    return _worker_chart
+
+
+def _fill_diagonal(task):
+    """
+    Часть диагонали для _fill_chart_wavefront: пары (отрезок, точка разбиения) с номерами [start, stop)
+    в порядке (i, k). Перебор тот же, что в _fill_cell_sets.
+    :return: Список (i, рёбра отрезка [i, i + length) в формате аргументов ParseForest.append_edges)
+    """
+    names, n, length, start, stop = task
+    _, _, (index, symbols), cells = _attach_chart(names)
+    binary = _worker_parser._binary_rule_ids()
+
+    def cell(i, j):
+        # Пары (id символа, узел) ячейки [i, j)
+        c = i * (2 * n - i + 1) // 2 - i - 1 + j  # номер ячейки в Chart.cells
+        pairs = cells.get(c)
+        if pairs is None:
+            first = 2 * index[2 * c]
+            flat = symbols[first:first + 2 * index[2 * c + 1]].tolist()
+            pairs = cells[c] = list(zip(flat[0::2], flat[1::2]))
+        return pairs
+
+    result = []
+    splits = length - 1
+    p = start
+    while p < stop:
+        i, offset = divmod(p, splits)
+        end = min(stop, (i + 1) * splits)
+        j = i + length
+        heads, firsts, lasts = [], [], []  # символы в порядке появления, их первое и последнее ребро
+        position = {}  # символ -> номер в heads
+        edge_left, edge_right, edge_next = array.array('i'), array.array('i'), array.array('i')
+        for k in range(i + 1 + offset, i + 1 + offset + end - p):
+            right_cell = cell(k, j)
+            if not right_cell:
+                continue
+            for B, left_node in cell(i, k):
+                by_right = binary[B]
+                if not by_right:
+                    continue
+                for C, right_node in right_cell:
+                    lefts = by_right.get(C)
+                    if not lefts:
+                        continue
+                    for left in lefts:
+                        edge = len(edge_left)
+                        h = position.get(left)
+                        if h is None:
+                            position[left] = len(heads)
+                            heads.append(left)
+                            firsts.append(edge)
+                            lasts.append(edge)
+                        else:
+                            edge_next[lasts[h]] = edge
+                            lasts[h] = edge
+                        edge_left.append(left_node)
+                        edge_right.append(right_node)
+                        edge_next.append(-1)
+        result.append((i, (heads, firsts, lasts, edge_left, edge_right, edge_next)))
+        p = end
+    return result
@@ -1,11 +1,96 @@
-import cfg, cky_parser
+import argparse
+import os
+import cfg, cky_parser, earley_parser, parse_cache
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # грамматика ищется рядом со скриптом, а не в текущем каталоге
+
+def parse_file(parser, input_path, output_path, workers):
+    # Пакетный разбор: по предложению на строку во входном файле, по дереву на строку в выходном
+    with open(input_path, 'r', encoding='utf8') as fin, open(output_path, 'w', encoding='utf8') as fout:
+        sentences = (line.strip().lower().split(' ') for line in fin)
+        for can_parse, parse_tree in parser.parse_many(sentences, workers=workers):
+            fout.write(parser.format_parse_tree(parse_tree) + "\n")
+
+def recognize_file(parser, input_path, output_path):
+    # Пакетная проверка без построения деревьев: True/False на строку в выходном файле
+    with open(input_path, 'r', encoding='utf8') as fin, open(output_path, 'w', encoding='utf8') as fout:
+        for line in fin:
+            fout.write(str(parser.recognize(line.strip().lower().split(' '))) + "\n")
+
+def incremental_loop(parser):
+    # Пошаговый ввод: по токену на строку, '-' отменяет последний токен, пустая строка завершает предложение
+    state = parser.incremental()
+    while True:
+        token = input("Следующее слово ('-' - отменить, пустая строка - закончить): ").strip().lower()
+        if token == '-':
+            if state.tokens:
+                state.pop()
+            print(f"Префикс: {' '.join(state.tokens)}")
+            continue
+        if not token:
+            can_parse, parse_table, backpointers = state.result()
+            if can_parse:
+                parser.print_parse_tree(parser.extract_parse_tree(state.tokens, parse_table, backpointers))
+            else:
+                print("Предложение не может быть разобрано.")
+            state = parser.incremental()
+            continue
+        viable = state.push(token)
+        print(("полное предложение" if state.can_parse() else "допустимый префикс") if viable else "ни одно предложение так не начинается")
 
 def main():
-    grammar = cfg.CFGrammar('rus_parse//cfgrammar.txt').to_cnf()
-    parser = cky_parser.CKYParser(grammar)
+    arg_parser = argparse.ArgumentParser(description='CKY-парсер для русского языка')
+    arg_parser.add_argument('-i', '--input', help='файл с предложениями, по одному на строку (пакетный режим)')
+    arg_parser.add_argument('-o', '--output', help='файл для деревьев разбора, по одному на строку')
+    arg_parser.add_argument('-w', '--workers', type=int, default=1, help='число процессов для разбора')
+    arg_parser.add_argument('--incremental', action='store_true', help='вводить по слову и проверять префикс после каждого')
+    arg_parser.add_argument('--earley', action='store_true', help='разбор алгоритмом Эрли по исходной грамматике (без CNF)')
+    arg_parser.add_argument('--cache', type=int, default=0, help='размер LRU-кэша повторяющихся предложений и фраз (CKY, 0 - выключен)')
+    arg_parser.add_argument('--cache-file', help='хранить кэш разборов в этом файле между пакетными запусками')
+    arg_parser.add_argument('--recognize', action='store_true', help='только проверять, разбирается ли предложение (CKY, в файл пишется True/False)')
+    arg_parser.add_argument('--wavefront', type=int, default=1, help='число процессов, заполняющих таблицу одного длинного предложения (CKY)')
+    arg_parser.add_argument('--keep-unary', action='store_true', help='оставить единичные правила A -> B вместо их удаления (CKY: грамматика меньше, в деревьях исходные цепочки)')
+    args = arg_parser.parse_args()
+
+    if args.earley:
+        if args.recognize:
+            arg_parser.error('--recognize поддерживается только CKY-парсером')
+        if args.incremental:
+            arg_parser.error('--incremental поддерживается только CKY-парсером')
+        parser = earley_parser.EarleyParser(cfg.CFGrammar(os.path.join(BASE_DIR, 'cfgrammar.txt')))
+    else:
+        if args.cache and args.workers > 1:  # кэш не передаётся в процессы parse_many
+            arg_parser.error('--cache не используется рабочими процессами, запускайте его с -w 1')
+        grammar = cfg.load_compiled(os.path.join(BASE_DIR, 'cfgrammar.txt'), to_cnf=True,
+                                    keep_unary=args.keep_unary)  # компилированный кэш рядом с текстом
+        cache = parse_cache.ParseCache(args.cache, path=args.cache_file) if args.cache else None
+        parser = cky_parser.CKYParser(grammar, cache=cache, wavefront_workers=args.wavefront)
+    if args.input and args.recognize:
+        recognize_file(parser, args.input, args.output or args.input + '.recognized')
+        return
+    if args.input:
+        parse_file(parser, args.input, args.output or args.input + '.parsed', args.workers)
+        if getattr(parser, 'cache', None) is not None:
+            print(f"Кэш: {parser.cache.stats()}")
+            if parser.cache.path:
+                parser.cache.save()
+        return
+    if args.incremental:
+        incremental_loop(parser)
+        return
 
     while True:
         sentence = input("Введите предложение для разбора: ").lower().split(' ')
+        if args.earley:
+            can_parse, parse_tree = parser.parse_tree(sentence)
+            if can_parse:
+                parser.print_parse_tree(parse_tree)
+            else:
+                print("Предложение не может быть разобрано.")
+            continue
+        if args.recognize:
+            print("Предложение может быть разобрано." if parser.recognize(sentence) else "Предложение не может быть разобрано.")
+            continue
         can_parse, parse_table, backpointers = parser.parse(sentence)
 
         if can_parse:
@@ -0,0 +1,272 @@
+import array
+import heapq
+import itertools
+
+
+class ParseForest:
+    def __init__(self, symbols):
+        """
+        Упакованный лес разбора CKY.
+        Узел - тройка (начало, конец, символ), он создаётся один раз и общий для всех выводов,
+        в которые входит (общие поддеревья хранятся однократно). У узла есть список выводов (рёбер):
+        бинарное ребро ссылается на два узла-потомка, единичное (A -> B) - на один узел той же ячейки,
+        лексическое - на слово предложения.
+        Узлы и рёбра лежат в целочисленных массивах, а не в кортежах и списках Python.
+        symbols - Нетерминалы грамматики (id -> символ)
+        """
+        self.symbols = symbols
+        self.symbol_ids = {symbol: i for i, symbol in enumerate(symbols)}
+        self.n = 0
+        self.node_index = {}  # ключ (i, j, символ), упакованный в одно число -> id узла
+        # узлы
+        self.node_start = array.array('i')
+        self.node_end = array.array('i')
+        self.node_symbol = array.array('i')
+        self.node_score = array.array('d')  # лучший внутренний log P узла (0 без вероятностей)
+        self.node_first_edge = array.array('i')
+        self.node_last_edge = array.array('i')
+        # рёбра (выводы)
+        self.edge_left = array.array('i')  # левый (единственный) потомок или -1 для лексического вывода
+        self.edge_right = array.array('i')  # правый потомок или -1 для единичного и лексического вывода
+        self.edge_score = array.array('d')  # log P правила
+        self.edge_next = array.array('i')  # следующий вывод того же узла или -1
+
+    def reset(self, n):
+        # Очищает лес для нового предложения длины n (массивы переиспользуются)
+        self.n = n
+        self.node_index.clear()
+        for data in (self.node_start, self.node_end, self.node_symbol, self.node_score,
+                     self.node_first_edge, self.node_last_edge,
+                     self.edge_left, self.edge_right, self.edge_score, self.edge_next):
+            del data[:]
+
+    def size(self):
+        # Число узлов и рёбер (снимок для truncate)
+        return len(self.node_start), len(self.edge_left)
+
+    def truncate(self, nodes, edges):
+        # Удаляет узлы и рёбра, добавленные после снимка size() (откат пошагового разбора).
+        # Рёбра добавляются только к узлам, созданным после снимка, поэтому старые узлы не меняются
+        for node in range(nodes, len(self.node_start)):
+            del self.node_index[self._key(self.node_start[node], self.node_end[node], self.node_symbol[node])]
+        for data in (self.node_start, self.node_end, self.node_symbol, self.node_score,
+                     self.node_first_edge, self.node_last_edge):
+            del data[nodes:]
+        for data in (self.edge_left, self.edge_right, self.edge_score, self.edge_next):
+            del data[edges:]
+
+    def export_cell(self, i, j, nodes, edges):
+        """
+        Узлы ячейки [i, j) и их рёбра, добавленные после снимка size() = (nodes, edges), в виде,
+        не зависящем от положения отрезка в предложении и номеров узлов (для кэша отрезков).
+        Ячейка заполняется целиком за один раз, поэтому её узлы и рёбра идут подряд.
+        :return: (потомки (начало, конец относительно i, символ), узлы (символ, log P, первое и последнее
+                 ребро), номера потомков левых и правых концов рёбер, log P рёбер, следующие рёбра).
+                 Номер потомка -1 - нет потомка, -2 - k - k-й узел самой ячейки (единичный вывод)
+        """
+        symbols = self.symbols
+        edge_left = self.edge_left[edges:]
+        edge_right = self.edge_right[edges:]
+        children = {-1: -1}
+        keys = []
+        for child in itertools.chain(edge_left, edge_right):
+            if child in children:
+                continue
+            if child >= nodes:
+                children[child] = -2 - (child - nodes)
+                continue
+            children[child] = len(keys)
+            keys.append((self.node_start[child] - i, self.node_end[child] - i, symbols[self.node_symbol[child]]))
+        cell_nodes = tuple((symbols[self.node_symbol[node]], self.node_score[node],
+                            self.node_first_edge[node] - edges, self.node_last_edge[node] - edges)
+                           for node in range(nodes, len(self.node_start)))
+        return (tuple(keys), cell_nodes,
+                array.array('i', [children[child] for child in edge_left]),
+                array.array('i', [children[child] for child in edge_right]),
+                self.edge_score[edges:],
+                array.array('i', [edge - edges if edge != -1 else -1 for edge in self.edge_next[edges:]]))
+
+    def import_cell(self, i, j, fragment):
+        """
+        Добавляет в лес ячейку [i, j), сохранённую export_cell; узлы-потомки уже должны быть в лесу.
+        :return: Список (символ, узел, log P) в исходном порядке
+        """
+        keys, cell_nodes, lefts, rights, scores, nexts = fragment
+        base = len(self.edge_left)
+        result = []
+        for symbol, score, first, last in cell_nodes:
+            node = self.add_node(i, j, symbol, score)
+            self.node_first_edge[node] = first + base
+            self.node_last_edge[node] = last + base
+            result.append((symbol, node, score))
+        ids = [self.node(i + start, i + end, symbol) for start, end, symbol in keys]
+        # отрицательные номера: -1 - нет потомка, -2 - k - узел ячейки (см. export_cell)
+        ids.extend(node for _, node, _ in reversed(result))
+        ids.append(-1)
+        self.edge_left.extend([ids[child] for child in lefts])
+        self.edge_right.extend([ids[child] for child in rights])
+        self.edge_score.extend(scores)
+        self.edge_next.extend([edge + base if edge != -1 else -1 for edge in nexts])
+        return result
+
+    def append_edges(self, i, j, cell, heads, firsts, lasts, lefts, rights, nexts):
+        """
+        Дописывает пачку бинарных выводов ячейки [i, j), построенную в другом процессе
+        (заполнение по диагоналям); узлы-потомки уже должны быть в лесу.
+        heads - Символы пачки в порядке первого появления, firsts и lasts - их первое и последнее ребро
+        lefts, rights, nexts - Потомки рёбер и следующее ребро того же символа (номера внутри пачки, -1 - нет)
+        cell - Ячейка {символ: узел}, в неё добавляются новые узлы
+        """
+        base = len(self.edge_left)
+        self.edge_left.extend(lefts)
+        self.edge_right.extend(rights)
+        self.edge_score.extend(itertools.repeat(0.0, len(lefts)))
+        self.edge_next.extend([edge + base if edge != -1 else -1 for edge in nexts])
+        for symbol, first, last in zip(heads, firsts, lasts):
+            node = cell.get(symbol)
+            if node is None:
+                node = cell[symbol] = self.add_node(i, j, symbol)
+            if self.node_first_edge[node] == -1:
+                self.node_first_edge[node] = first + base
+            else:
+                self.edge_next[self.node_last_edge[node]] = first + base
+            self.node_last_edge[node] = last + base
+
+    def _key(self, i, j, symbol_id):
+        # номер отрезка в треугольной нумерации не зависит от длины предложения,
+        # поэтому лес может расти справа при пошаговом разборе
+        return (j * (j - 1) // 2 + i) * len(self.symbols) + symbol_id
+
+    def node(self, i, j, symbol):
+        # Возвращает id узла (i, j, symbol) или None
+        symbol_id = self.symbol_ids.get(symbol)
+        if symbol_id is None:
+            return None
+        return self.node_index.get(self._key(i, j, symbol_id))
+
+    def add_node(self, i, j, symbol, score=0.0):
+        # Возвращает id узла (i, j, symbol), создавая его при необходимости
+        key = self._key(i, j, self.symbol_ids[symbol])
+        node = self.node_index.get(key)
+        if node is None:
+            node = self.node_index[key] = len(self.node_start)
+            self.node_start.append(i)
+            self.node_end.append(j)
+            self.node_symbol.append(self.symbol_ids[symbol])
+            self.node_score.append(score)
+            self.node_first_edge.append(-1)
+            self.node_last_edge.append(-1)
+        return node
+
+    def add_edge(self, node, left=-1, right=-1, score=0.0):
+        # Добавляет узлу вывод: бинарный (left, right) или лексический (без потомков)
+        edge = len(self.edge_left)
+        self.edge_left.append(left)
+        self.edge_right.append(right)
+        self.edge_score.append(score)
+        self.edge_next.append(-1)
+        if self.node_first_edge[node] == -1:
+            self.node_first_edge[node] = edge
+        else:
+            self.edge_next[self.node_last_edge[node]] = edge
+        self.node_last_edge[node] = edge
+        return edge
+
+    def edges(self, node):
+        # Выводы узла в порядке добавления
+        edge = self.node_first_edge[node]
+        while edge != -1:
+            yield edge
+            edge = self.edge_next[edge]
+
+    def children(self, edge):
+        # Узлы-потомки вывода
+        return [child for child in (self.edge_left[edge], self.edge_right[edge]) if child != -1]
+
+    def derivations(self, i, j, symbol):
+        # Выводы символа на отрезке [i, j) в прежнем формате указателей: [(B, C, k), ...]
+        node = self.node(i, j, symbol)
+        if node is None:
+            return []
+        result = []
+        for edge in self.edges(node):
+            children = self.children(edge)
+            if len(children) == 2:
+                left, right = children
+                result.append((self.symbols[self.node_symbol[left]], self.symbols[self.node_symbol[right]],
+                               self.node_end[left]))
+        return result
+
+    def build_tree(self, root, sentence):
+        """
+        Дерево по первому (для PCFG - лучшему) выводу каждого узла.
+        Обход без рекурсии, поэтому длина предложения не упирается в предел глубины рекурсии Python.
+        """
+        preorder = []
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            edge = self.node_first_edge[node]
+            preorder.append((node, edge))
+            stack.extend(reversed(self.children(edge)))
+        return self._assemble(preorder, sentence)
+
+    def iter_trees(self, root, sentence, k=None):
+        """
+        Лениво перечисляет деревья с корнем root в порядке убывания вероятности, без вероятностей
+        (все оценки 0) - в порядке обнаружения выводов. Используется поиск A* по частичным
+        выводам: оценка ещё не раскрытых узлов - их лучший внутренний log P, поэтому очередное
+        полное дерево всегда лучшее из оставшихся. Перебираются только выводы, сохранённые в лесу:
+        после разбора Витерби без all_derivations (CKYParser) это одно дерево. Деревья строятся по запросу.
+        k - Максимальное число деревьев (None - все)
+        """
+        node_score = self.node_score
+        edge_score = self.edge_score
+        counter = 0
+        # (-(g + h), -номер, g, h, ещё не раскрытые узлы, выбранные выводы в виде связного списка)
+        heap = [(-node_score[root], 0, 0.0, node_score[root], (root,), None)]
+        produced = 0
+        while heap and (k is None or produced < k):
+            _, _, g, h, frontier, choices = heapq.heappop(heap)
+            if not frontier:
+                preorder = []
+                while choices is not None:
+                    node, edge, choices = choices
+                    preorder.append((node, edge))
+                preorder.reverse()
+                produced += 1
+                yield self._assemble(preorder, sentence)
+                continue
+
+            node, rest = frontier[0], frontier[1:]
+            # выводы кладутся в обратном порядке, чтобы при равных оценках первым шёл первый вывод
+            for edge in reversed(list(self.edges(node))):
+                children = tuple(self.children(edge))
+                new_h = h - node_score[node] + sum(node_score[child] for child in children)
+                new_g = g + edge_score[edge]
+                counter += 1
+                # при равных оценках первым раскрывается последнее состояние (поиск в глубину)
+                heapq.heappush(heap, (-(new_g + new_h), -counter, new_g, new_h, children + rest,
+                                      (node, edge, choices)))
+
+    def _assemble(self, preorder, sentence):
+        # Собирает вложенные кортежи из списка (узел, вывод) в прямом порядке обхода
+        symbols = self.symbols
+        stack = []  # [символ, готовые потомки, ожидаемое число потомков]
+        for node, edge in preorder:
+            symbol = symbols[self.node_symbol[node]]
+            expected = len(self.children(edge))
+            if expected:
+                stack.append([symbol, [], expected])
+                continue
+            subtree = (symbol, sentence[self.node_start[node]])
+            while stack:
+                parent = stack[-1]
+                parent[1].append(subtree)
+                if len(parent[1]) < parent[2]:
+                    break
+                stack.pop()
+                subtree = (parent[0], *parent[1])
+            if not stack:
+                return subtree
+        return None
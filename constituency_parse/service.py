@@ -0,0 +1,313 @@
+"""
+Постоянно работающий сервис разбора составляющих для английского и русского языков.
+
+Запуск из любого каталога:
+    python constituency_parse/service.py --port 8765 --workers 4
+    python constituency_parse/service.py --stdio < requests.jsonl
+
+Протокол - JSON по строке на запрос и ответ (через TCP-сокет или stdin/stdout):
+    {"id": 1, "lang": "eng", "sentence": "The cat sat on the mat"}
+    {"id": 2, "lang": "rus", "sentence": ["мальчик", "читает", "книга"], "mode": "recognize"}
+    -> {"id": 1, "ok": true, "parsed": true, "tree": "(S ...)", "seconds": 0.004}
+    -> {"id": 3, "ok": false, "error": "timeout"}
+Грамматики загружаются один раз при запуске (компилированный кэш .cfgc, через mmap общий для процессов),
+разбор идёт в пуле процессов, а цикл asyncio только читает запросы и пишет ответы, поэтому
+долгий разбор одного клиента не задерживает остальных. Ответы одного соединения приходят
+по мере готовности, их сопоставляют с запросами по id.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, 'eng_parse'))  # код парсера одинаков для eng_parse и rus_parse
+
+import cfg
+import cky_parser
+
+# Грамматики языков (как в eng_parse/main.py и rus_parse/main.py) и приведение входа к словам грамматики
+LANGUAGES = {
+    'eng': {'grammar': os.path.join(BASE_DIR, 'eng_parse', 'cnf_grammar.txt'), 'to_cnf': False,
+            'unary_grammar': os.path.join(BASE_DIR, 'eng_parse', 'cf_grammar.txt'), 'lower': False},
+    'rus': {'grammar': os.path.join(BASE_DIR, 'rus_parse', 'cfgrammar.txt'), 'to_cnf': True,
+            'unary_grammar': os.path.join(BASE_DIR, 'rus_parse', 'cfgrammar.txt'), 'lower': True},
+}
+MODES = ('parse', 'recognize')
+
+
+class RequestTimeout(Exception):
+    # Разбор не уложился во время, оставшееся у запроса
+    pass
+
+
+def load_grammars(languages, keep_unary=False):
+    # Компилированные грамматики языков {язык: CompiledGrammar}
+    grammars = {}
+    for lang in languages:
+        config = LANGUAGES[lang]
+        if keep_unary:
+            grammars[lang] = cfg.load_compiled(config['unary_grammar'], to_cnf=True, keep_unary=True)
+        else:
+            grammars[lang] = cfg.load_compiled(config['grammar'], to_cnf=config['to_cnf'])
+    return grammars
+
+
+_worker_parsers = None  # парсеры рабочего процесса {язык: CKYParser}
+
+
+def _alarm(signum, frame):
+    raise RequestTimeout()
+
+
+def _init_worker(grammars, options):
+    # Строит парсеры всех языков один раз при запуске рабочего процесса
+    global _worker_parsers
+    _worker_parsers = {lang: cky_parser.CKYParser(grammar, **options) for lang, grammar in grammars.items()}
+    if hasattr(signal, 'setitimer'):
+        signal.signal(signal.SIGALRM, _alarm)
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def _run_request(lang, mode, tokens, timeout):
+    """
+    Разбор одного запроса в рабочем процессе. Таймер SIGALRM прерывает разбор по истечении timeout,
+    чтобы процесс сразу освободился для следующих запросов (таблица парсера очищается при следующем разборе).
+    :return: Словарь полей ответа
+    """
+    parser = _worker_parsers[lang]
+    start = time.perf_counter()
+    use_timer = timeout is not None and hasattr(signal, 'setitimer')
+    if use_timer:
+        signal.setitimer(signal.ITIMER_REAL, max(timeout, 1e-3))
+    try:
+        if mode == 'recognize':
+            result = {'parsed': parser.recognize(tokens)}
+        else:
+            can_parse, tree = parser.parse_tree(tokens)
+            result = {'parsed': can_parse, 'tree': parser.format_parse_tree(tree) if can_parse else None}
+    finally:
+        if use_timer:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+class ParseService:
+    def __init__(self, languages, workers=1, timeout=None, max_concurrency=None, max_pending=None,
+                 keep_unary=False, options=None):
+        """
+        Сервис разбора: грамматики загружены, пул процессов запущен, запросы выполняются handle.
+        languages - Языки, грамматики которых загружаются при запуске
+        workers - Число процессов разбора
+        timeout - Ограничение времени на запрос в секундах (ожидание в очереди тоже считается; None - без него)
+        max_concurrency - Сколько запросов разбирается одновременно (по умолчанию workers)
+        max_pending - Сколько запросов может ждать и выполняться сразу; сверх этого запрос сразу
+                      получает ошибку "overloaded" (None - без ограничения)
+        options - Параметры CKYParser (pcfg, beam, ...)
+        """
+        start = time.perf_counter()
+        self.grammars = load_grammars(languages, keep_unary)
+        self.load_seconds = time.perf_counter() - start
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.pending = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency or workers)
+        self.options = options or {}
+        self.workers = workers
+        self._executor = self._start_executor()
+        self.lower = {lang: LANGUAGES[lang]['lower'] for lang in languages}
+
+    def _start_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                   initargs=(self.grammars, self.options))
+
+    def _restart_executor(self, broken):
+        # Пул, в котором умер процесс, больше не принимает задачи: заменяем его новым один раз,
+        # даже если об отказе сообщили несколько запросов сразу
+        if self._executor is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._start_executor()
+
+    async def warm_up(self):
+        # Запускает рабочие процессы заранее, чтобы первые запросы не ждали их создания
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._executor, _warm_up) for _ in range(self.workers)))
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+
+    def _tokens(self, request):
+        # Проверяет запрос; возвращает (язык, режим, токены)
+        lang = request.get('lang')
+        if lang not in self.grammars:
+            raise ValueError(f"unknown language {lang!r}, expected one of {sorted(self.grammars)}")
+        mode = request.get('mode', 'parse')
+        if mode not in MODES:
+            raise ValueError(f"unknown mode {mode!r}, expected one of {list(MODES)}")
+        sentence = request.get('sentence')
+        if isinstance(sentence, str):
+            tokens = sentence.split()
+        elif isinstance(sentence, list) and all(isinstance(token, str) for token in sentence):
+            tokens = sentence
+        else:
+            raise ValueError("sentence must be a string or a list of tokens")
+        if not tokens:
+            raise ValueError("empty sentence")
+        if self.lower[lang]:
+            tokens = [token.lower() for token in tokens]
+        return lang, mode, tokens
+
+    async def handle(self, request):
+        """
+        Выполняет один запрос. Любая ошибка разбора (исключение в рабочем процессе, его аварийное
+        завершение, ошибка передачи данных) становится ответом с ok: false, а не обрывает сессию.
+        :return: Словарь ответа (всегда с полями id и ok)
+        """
+        received = time.perf_counter()
+        request_id = request.get('id') if isinstance(request, dict) else None
+        try:
+            if not isinstance(request, dict):
+                raise ValueError("request must be a JSON object")
+            lang, mode, tokens = self._tokens(request)
+        except ValueError as error:
+            return {'id': request_id, 'ok': False, 'error': str(error)}
+        if self.max_pending is not None and self.pending >= self.max_pending:
+            return {'id': request_id, 'ok': False, 'error': 'overloaded'}
+
+        self.pending += 1
+        try:
+            result = await asyncio.wait_for(self._run(lang, mode, tokens, received), self._grace(self.timeout))
+        except (asyncio.TimeoutError, RequestTimeout):
+            return {'id': request_id, 'ok': False, 'error': 'timeout'}
+        except Exception as error:
+            return {'id': request_id, 'ok': False, 'error': repr(error)}
+        finally:
+            self.pending -= 1
+        return {'id': request_id, 'ok': True, **result}
+
+    async def _run(self, lang, mode, tokens, received):
+        async with self._semaphore:
+            remaining = None
+            if self.timeout is not None:
+                remaining = self.timeout - (time.perf_counter() - received)
+                if remaining <= 0:
+                    raise RequestTimeout()
+            loop = asyncio.get_running_loop()
+            executor = self._executor
+            try:
+                return await loop.run_in_executor(executor, _run_request, lang, mode, tokens, remaining)
+            except BrokenProcessPool:
+                self._restart_executor(executor)
+                raise
+
+    @staticmethod
+    def _grace(timeout):
+        # Запас сверх таймера рабочего процесса на передачу ответа (и ограничение там, где таймера нет)
+        return None if timeout is None else timeout + 0.5
+
+    async def serve_lines(self, read_line, write_line):
+        """
+        Обслуживает поток запросов: по JSON-объекту на строку, ответы пишутся по мере готовности.
+        read_line - Корутина, возвращающая очередную строку (b'' или '' - конец потока)
+        write_line - Функция, записывающая строку ответа
+        """
+        tasks = set()
+
+        async def respond(line):
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {'id': None, 'ok': False, 'error': 'invalid JSON'}
+            else:
+                response = await self.handle(request)
+            await write_line(json.dumps(response, ensure_ascii=False))
+
+        while True:
+            line = await read_line()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            task = asyncio.create_task(respond(line))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def handle_connection(self, reader, writer):
+        # Соединение TCP: запросы и ответы - строки JSON
+        lock = asyncio.Lock()
+
+        async def write_line(text):
+            async with lock:
+                writer.write(text.encode('utf8') + b'\n')
+                await writer.drain()
+
+        try:
+            await self.serve_lines(reader.readline, write_line)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(args):
+    service = ParseService(args.languages, args.workers, args.timeout, args.max_concurrency, args.max_pending,
+                           args.keep_unary, {'pcfg': args.pcfg, 'beam': args.beam})
+    try:
+        await service.warm_up()
+        print(f"Grammars {', '.join(args.languages)} loaded in {service.load_seconds:.2f} s, "
+              f"{args.workers} workers", file=sys.stderr)
+        if args.stdio:
+            loop = asyncio.get_running_loop()
+
+            async def read_line():
+                return await loop.run_in_executor(None, sys.stdin.readline)
+
+            async def write_line(text):
+                sys.stdout.write(text + '\n')
+                sys.stdout.flush()
+
+            await service.serve_lines(read_line, write_line)
+            return
+        server = await asyncio.start_server(service.handle_connection, args.host, args.port)
+        print(f"Listening on {args.host}:{args.port}", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Resident constituency parsing service (JSON lines)')
+    arg_parser.add_argument('--stdio', action='store_true', help='read requests from stdin, write responses to stdout')
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8765)
+    arg_parser.add_argument('--languages', nargs='+', choices=sorted(LANGUAGES), default=sorted(LANGUAGES))
+    arg_parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help='number of parsing processes')
+    arg_parser.add_argument('--timeout', type=float, help='seconds per request, including time in the queue')
+    arg_parser.add_argument('--max-concurrency', type=int, help='requests parsed at once (default: --workers)')
+    arg_parser.add_argument('--max-pending', type=int, help='reject requests with "overloaded" beyond this many in flight')
+    arg_parser.add_argument('--keep-unary', action='store_true', help='keep unary rules A -> B (smaller grammars)')
+    arg_parser.add_argument('--pcfg', action='store_true', help='Viterbi parsing with rule probabilities')
+    arg_parser.add_argument('--beam', type=int, help='with --pcfg: best symbols kept per cell')
+    args = arg_parser.parse_args()
+    if args.workers < 1:
+        arg_parser.error('--workers must be positive')
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()